@@ -2,6 +2,8 @@ from fastapi import APIRouter, Request
 from datetime import datetime
 import socket
 
+from app.core.metrics import metrics
+
 router = APIRouter()
 
 @router.get("/")
@@ -20,3 +22,7 @@ def read_root(request: Request):
         "datetime": current_time,
         "node_name": hostname
     }
+
+@router.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
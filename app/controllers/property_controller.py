@@ -1,7 +1,11 @@
 import asyncio
 import json
 import logging
+from typing import Union
 
+from app.core.config import config
+from app.core.my.classifiers.model_registry import model_registry
+from app.core.my.extractors.pdf_image_extractor import ExtractedImage, ImageDedupIndex
 from app.repositories.image_repository import ImageRepository
 from app.schemas.property_schema import PropertySchema, PropertyImagesSchema
 from app.services.property_image_service import PropertyImageService
@@ -34,22 +38,36 @@ class PropertyController:
                 property_data, existing_images
             )
 
-        # extracts images from PDF and splits the result into bundles
-        bundles = await self.property_image_service.extract_images(
+        # images a previous run classified with the current model (and uploaded, if valid) are skipped
+        dedup_index = ImageDedupIndex()
+        if config.property_dedup_persisted:
+            model_version = model_registry.get_real_estate_classifier().get_model_version()
+            dedup_index = ImageDedupIndex(await self.image_repository.get_image_digests(
+                property_data.property_id, model_version
+            ))
+
+        # extracts images from PDF and processes each bundle as soon as it is filled
+        bundle_count = await self.process_property_om_image_stream(
             property_data,
-            bundle_size=10
+            bundle_size=10,
+            dedup_index=dedup_index
         )
 
+        # stored only once every bundle is processed and only for settled images, so a failed run
+        # or a failed classification or upload doesn't hide images from the next one
+        if config.property_dedup_persisted:
+            await self.image_repository.add_image_digests(
+                property_data.property_id,
+                model_version,
+                dedup_index.new_digests
+            )
+
         # sends empty result if nothing is found in the PDF
-        if not bundles:
+        if not bundle_count:
             return await self.send_property_om_images(
                 property_data, []
             )
 
-        await self.process_property_om_image_bundles(
-            bundles=bundles, property_data=property_data
-        )
-
         # # 20240705, Dima: commented with implementing queueless
         # # processes the first bundle
         # property_images = PropertyImagesSchema.from_params(
@@ -66,7 +84,7 @@ class PropertyController:
         #     bundles[1:]
         # )
 
-    async def process_property_om_image_bundles(self, bundles: list[list[str]], property_data: PropertySchema):
+    async def process_property_om_image_bundles(self, bundles: list[list[Union[str, ExtractedImage]]], property_data: PropertySchema):
         tasks = []
         for bundle in bundles:
             property_images = PropertyImagesSchema.from_params(
@@ -78,11 +96,33 @@ class PropertyController:
 
         await asyncio.gather(*tasks)
 
-    async def process_property_om_images(self, property_images: PropertyImagesSchema):
+    async def process_property_om_image_stream(self, property_data: PropertySchema, bundle_size: int, dedup_index: ImageDedupIndex = None) -> int:
+        # the semaphore pauses extraction when too many bundles are waiting for classification and upload
+        semaphore = asyncio.Semaphore(config.max_inflight_bundles)
+        tasks = []
+
+        async def process_bundle(property_images: PropertyImagesSchema):
+            try:
+                await self.process_property_om_images(property_images, dedup_index)
+            finally:
+                semaphore.release()
+
+        async for bundle in self.property_image_service.iter_image_bundles(property_data, bundle_size, dedup_index):
+            await semaphore.acquire()
+            property_images = PropertyImagesSchema.from_params(
+                property_data=property_data,
+                images=bundle,
+            )
+            tasks.append(asyncio.create_task(process_bundle(property_images)))
+
+        await asyncio.gather(*tasks)
+        return len(tasks)
+
+    async def process_property_om_images(self, property_images: PropertyImagesSchema, dedup_index: ImageDedupIndex = None):
         logging.info(f"Start image processing for property_id: {property_images.property_data.property_id}")
         property_data = property_images.property_data
         image_urls = await self.property_image_service.process_images(
-            property_images
+            property_images, dedup_index
         )
 
         await self.send_property_om_images(
@@ -29,6 +29,29 @@ class Config(BaseModel):
     s3_access_key: str = os.getenv("S3_ACCESS_KEY", "")
     s3_secret_key: str = os.getenv("S3_SECRET_KEY", "")
     s3_region: str = os.getenv("S3_REGION", "us-west-2")
+    s3_max_pool_connections: int = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+    # objects above the threshold are downloaded as parallel ranged GETs
+    s3_ranged_download_threshold_mb: int = int(os.getenv("S3_RANGED_DOWNLOAD_THRESHOLD_MB", "16"))
+    s3_download_part_size_mb: int = int(os.getenv("S3_DOWNLOAD_PART_SIZE_MB", "8"))
+    s3_download_concurrency: int = int(os.getenv("S3_DOWNLOAD_CONCURRENCY", "8"))
+    s3_download_chunk_size_kb: int = int(os.getenv("S3_DOWNLOAD_CHUNK_SIZE_KB", "256"))
+    # uploads above the threshold go as multipart (S3) or chunked resumable (GCS) uploads
+    upload_multipart_threshold_mb: int = int(os.getenv("UPLOAD_MULTIPART_THRESHOLD_MB", "8"))
+    upload_part_size_mb: int = int(os.getenv("UPLOAD_PART_SIZE_MB", "8"))  # S3 parts are at least 5 MB
+    s3_upload_concurrency: int = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+    image_cache_control: str = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+    # 'random' or 'content' image keys; content keys are stored under the property or under a global prefix,
+    # and are uploaded only if the key is not in the known-keys cache ('cache') or not found by a HEAD request ('head')
+    image_key_scheme: str = os.getenv("IMAGE_KEY_SCHEME", "random")
+    image_key_scope: str = os.getenv("IMAGE_KEY_SCOPE", "property")
+    image_key_prefix: str = os.getenv("IMAGE_KEY_PREFIX", "images")
+    image_exists_check: str = os.getenv("IMAGE_EXISTS_CHECK", "head")
+    known_image_keys_max_size: int = int(os.getenv("KNOWN_IMAGE_KEYS_MAX_SIZE", "100000"))
+
+    # GCS transfers running at the same time; set STORAGE_EMULATOR_HOST to use a local fake-gcs-server
+    gcs_max_workers: int = int(os.getenv("GCS_MAX_WORKERS", "16"))
+    gcs_emulator_host: str = os.getenv("STORAGE_EMULATOR_HOST", "")
+    gcs_emulator_project: str = os.getenv("GCS_EMULATOR_PROJECT", "test-project")
 
     rabbitmq_host: str = os.getenv("RABBITMQ_HOST", "")
     rabbitmq_virtual_host: str = os.getenv("RABBITMQ_VIRTUAL_HOST", "")
@@ -44,6 +67,82 @@ class Config(BaseModel):
     pdf_images_path: str = os.path.join(static_path, 'pdf_images')
     classifier_path: str = os.path.join(static_path, 'classifier')
 
+    # 'keras', 'tflite' or 'onnx'; exported models are created with app.core.my.classifiers.export_model
+    classifier_backend: str = os.getenv("CLASSIFIER_BACKEND", "keras")
+    classifier_backend_threads: int = int(os.getenv("CLASSIFIER_BACKEND_THREADS", "0"))
+    # derived from the model file when empty
+    classifier_model_version: str = os.getenv("CLASSIFIER_MODEL_VERSION", "")
+    classifier_batch_size: int = int(os.getenv("CLASSIFIER_BATCH_SIZE", "32"))
+    inference_max_batch_size: int = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "64"))
+    inference_max_wait_ms: float = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+    # perceptual-hash -> verdict cache, 'file' or 'mongo' backed
+    verdict_cache_enabled: bool = os.getenv("VERDICT_CACHE_ENABLED", "true").lower() == "true"
+    verdict_cache_backend: str = os.getenv("VERDICT_CACHE_BACKEND", "file")
+    verdict_cache_max_size: int = int(os.getenv("VERDICT_CACHE_MAX_SIZE", "100000"))
+    verdict_cache_flush_every: int = int(os.getenv("VERDICT_CACHE_FLUSH_EVERY", "100"))
+    verdict_cache_path: str = os.path.join(classifier_path, 'verdict_cache.json')
+
+    # cheap statistics cascade that rejects obvious non-photos before the CNN
+    prefilter_enabled: bool = os.getenv("PREFILTER_ENABLED", "false").lower() == "true"
+    prefilter_rules: str = os.getenv("PREFILTER_RULES", "min_side,aspect_ratio,uniform,histogram_spread,colour_entropy,edge_density")
+    prefilter_thumbnail_size: int = int(os.getenv("PREFILTER_THUMBNAIL_SIZE", "96"))
+    prefilter_min_side: int = int(os.getenv("PREFILTER_MIN_SIDE", "150"))
+    prefilter_max_aspect_ratio: float = float(os.getenv("PREFILTER_MAX_ASPECT_RATIO", "4.0"))
+    prefilter_min_std: float = float(os.getenv("PREFILTER_MIN_STD", "6.0"))
+    prefilter_min_histogram_spread: float = float(os.getenv("PREFILTER_MIN_HISTOGRAM_SPREAD", "24.0"))
+    prefilter_min_colour_entropy: float = float(os.getenv("PREFILTER_MIN_COLOUR_ENTROPY", "2.5"))
+    prefilter_max_edge_density: float = float(os.getenv("PREFILTER_MAX_EDGE_DENSITY", "0.45"))
+    prefilter_edge_threshold: float = float(os.getenv("PREFILTER_EDGE_THRESHOLD", "48.0"))
+
+    # 'thread' or 'process'; 0 workers lets the executor pick its default
+    cpu_executor: str = os.getenv("CPU_EXECUTOR", "thread")
+    cpu_executor_workers: int = int(os.getenv("CPU_EXECUTOR_WORKERS", "0"))
+    # start method of process pools: 'spawn' or 'forkserver', forking a process with running threads isn't safe
+    process_start_method: str = os.getenv("PROCESS_START_METHOD", "spawn")
+
+    # keeps extracted images decoded in memory, only real estate images are encoded and written for upload
+    in_memory_pipeline: bool = os.getenv("IN_MEMORY_PIPELINE", "false").lower() == "true"
+    # valid in-memory images are uploaded from their buffers instead of being written to disk first
+    upload_from_memory: bool = os.getenv("UPLOAD_FROM_MEMORY", "true").lower() == "true"
+    # PDFs of a property downloaded and extracted at the same time
+    pdf_concurrency: int = int(os.getenv("PDF_CONCURRENCY", "3"))
+    # PDFs are downloaded into memory, larger ones are spilled to a temporary file removed after extraction
+    pdf_memory_download: bool = os.getenv("PDF_MEMORY_DOWNLOAD", "false").lower() == "true"
+    pdf_memory_threshold_mb: int = int(os.getenv("PDF_MEMORY_THRESHOLD_MB", "64"))
+    # copies every classified image into work_dataset for further training
+    classifier_dataset_collection: bool = os.getenv("CLASSIFIER_DATASET_COLLECTION", "true").lower() == "true"
+
+    # digests of images classified (and uploaded, if valid) are kept in the om-images record per model version,
+    # so re-runs skip them; images whose classification or upload failed are processed again
+    property_dedup_persisted: bool = os.getenv("PROPERTY_DEDUP_PERSISTED", "true").lower() == "true"
+    # 'images' extracts embedded image objects, 'render' crops photo regions out of rendered pages
+    pdf_extraction_mode: str = os.getenv("PDF_EXTRACTION_MODE", "images")
+    pdf_render_max_dpi: int = int(os.getenv("PDF_RENDER_MAX_DPI", "150"))
+    pdf_render_min_dpi: int = int(os.getenv("PDF_RENDER_MIN_DPI", "72"))
+    pdf_render_target_size: int = int(os.getenv("PDF_RENDER_TARGET_SIZE", "1024"))
+    pdf_render_jpeg_quality: int = int(os.getenv("PDF_RENDER_JPEG_QUALITY", "90"))
+    # per-PDF extraction budget, 0 disables a limit; when one is hit extraction stops with partial results
+    pdf_max_seconds: float = float(os.getenv("PDF_MAX_SECONDS", "120"))
+    pdf_max_pages: int = int(os.getenv("PDF_MAX_PAGES", "0"))
+    pdf_max_image_pixels: int = int(os.getenv("PDF_MAX_IMAGE_PIXELS", str(12000 * 12000)))
+    pdf_max_images: int = int(os.getenv("PDF_MAX_IMAGES", "0"))
+    # dedup digest of extracted image bytes: sha256 (fastest with SHA CPU extensions), blake2b or xxh3_128 (requires xxhash)
+    image_digest_algorithm: str = os.getenv("IMAGE_DIGEST_ALGORITHM", "sha256")
+    # page-parallel extraction in a process pool for large PDFs, 1 worker keeps it serial;
+    # 0 keeps 'images' mode serial and gives 'render' mode a worker per CPU
+    pdf_extraction_workers: int = int(os.getenv("PDF_EXTRACTION_WORKERS", "0"))
+    pdf_extraction_parallel_min_pages: int = int(os.getenv("PDF_EXTRACTION_PARALLEL_MIN_PAGES", "100"))
+    # images buffered between the extraction thread and the consumer before extraction pauses
+    pdf_extraction_queue_size: int = int(os.getenv("PDF_EXTRACTION_QUEUE_SIZE", "8"))
+    # threads running serial extraction producers, one per PDF being extracted; a PDF waits for a free one
+    pdf_producer_threads: int = int(os.getenv("PDF_PRODUCER_THREADS", "32"))
+    # bundles being classified and uploaded at the same time while extraction keeps streaming
+    max_inflight_bundles: int = int(os.getenv("MAX_INFLIGHT_BUNDLES", "4"))
+
+    event_loop_lag_interval_ms: float = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "500"))
+    event_loop_lag_warning_ms: float = float(os.getenv("EVENT_LOOP_LAG_WARNING_MS", "200"))
+
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
 
 
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from app.core.config import config
+
+
+class CpuExecutor:
+    # runs CPU-bound work (image decoding, preprocessing) off the event loop in a thread or process pool
+    def __init__(self, kind=None, max_workers=None, start_method=None, thread_name_prefix='cpu-executor'):
+        self.kind = kind if kind is not None else config.cpu_executor
+        self.max_workers = max_workers if max_workers is not None else config.cpu_executor_workers
+        # pools are created lazily, when model, scheduler and storage threads already run, so workers aren't forked
+        self.start_method = start_method if start_method is not None else config.process_start_method
+        self.thread_name_prefix = thread_name_prefix
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self) -> Executor:
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = self.create_executor()
+        return self.executor
+
+    def create_executor(self) -> Executor:
+        max_workers = self.max_workers or None
+        logging.info(f"Creating CPU executor: kind={self.kind}, max_workers={max_workers}")
+        if self.kind == 'process':
+            return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(self.start_method))
+        if self.kind == 'thread':
+            return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=self.thread_name_prefix)
+        raise ValueError(f"Unknown CPU executor kind: {self.kind}")
+
+    async def run(self, func: Callable, *args):
+        # func and args must be picklable when the process pool is used
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(), func, *args)
+
+    def shutdown(self, wait=True) -> None:
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
+
+
+cpu_executor = CpuExecutor()
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import threading
+import time
+
+
+class Metrics:
+    # in-process counters, gauges and timings exposed through the /metrics endpoint
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name: str, value=1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_counter(self, name: str):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def set_gauge(self, name: str, value) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            timing = self.timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0})
+            timing["count"] += 1
+            timing["sum"] += value
+            timing["max"] = max(timing["max"], value)
+            timing["last"] = value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            timings = {
+                name: {**timing, "avg": timing["sum"] / timing["count"] if timing["count"] else 0.0}
+                for name, timing in self.timings.items()
+            }
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": timings,
+            }
+
+
+class EventLoopLagMonitor:
+    # measures how late the event loop wakes up a sleeping task, i.e. how long it was blocked
+    def __init__(self, interval_ms: float, metric_name='event_loop_lag_ms', warning_ms=None):
+        self.interval = interval_ms / 1000
+        self.metric_name = metric_name
+        self.warning_ms = warning_ms
+        self.task = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - started_at - self.interval) * 1000)
+            metrics.observe(self.metric_name, lag_ms)
+            if self.warning_ms is not None and lag_ms > self.warning_ms:
+                logging.warning(f"Event loop was blocked for {lag_ms:.1f} ms")
+
+
+metrics = Metrics()
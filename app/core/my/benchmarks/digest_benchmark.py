@@ -0,0 +1,53 @@
+"""
+Dedup digest benchmark
+Measures throughput (MB/s) of the image dedup digests on typical extracted image sizes.
+usage: python -m app.core.my.benchmarks.digest_benchmark --sizes 50 500 5000 --seconds 1
+"""
+import argparse
+import hashlib
+import os
+import time
+
+from app.utils.helpers import get_digest_func
+
+
+def sha256_hexdigest(data: bytes) -> str:
+    # previous dedup key, kept as the baseline
+    return hashlib.sha256(data).hexdigest()
+
+
+def measure(digest_func, data: bytes, seconds: float) -> float:
+    iterations = 0
+    start_time = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        for _ in range(10):
+            digest_func(data)
+        iterations += 10
+        elapsed = time.perf_counter() - start_time
+    return iterations * len(data) / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000], help='image sizes in KB')
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    digest_funcs = {'sha256-hex': sha256_hexdigest}
+    for algorithm in ('sha256', 'blake2b', 'xxh3_128'):
+        try:
+            digest_funcs[algorithm] = get_digest_func(algorithm)
+        except ImportError:
+            print(f'{algorithm}: skipped, xxhash is not installed')
+
+    for size in args.sizes:
+        data = os.urandom(size * 1024)
+        results = ', '.join(
+            f'{name} {measure(digest_func, data, args.seconds):.0f} MB/s' for name, digest_func in digest_funcs.items()
+        )
+        print(f'{size:>6} KB: {results}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+GCS adapter check against a fake-gcs-server
+Uploads and downloads synthetic images through GCPAdapter one by one and concurrently, verifies the round trip
+and compares the timings.
+usage: make start-gcs-emulator && make gcs-check
+   or: STORAGE_EMULATOR_HOST=http://localhost:4443 python -m app.core.my.benchmarks.gcs_adapter_benchmark --files 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from app.core.config import config
+from app.infrastructure.adapters.gcp_adapter import GCPAdapter, gcs_executor
+
+
+async def transfer(adapter: GCPAdapter, bucket_name, paths, concurrent) -> float:
+    start_time = time.perf_counter()
+    cloud_buckets = [
+        {'bucket_name': bucket_name, 'bucket_path': os.path.basename(path), 'file_name': os.path.basename(path)}
+        for path in paths
+    ]
+    if concurrent:
+        await asyncio.gather(*[adapter.upload_file(bucket_name, path) for path in paths])
+        downloads = await asyncio.gather(*[adapter.download_bytes(cloud_bucket) for cloud_bucket in cloud_buckets])
+    else:
+        downloads = []
+        for path, cloud_bucket in zip(paths, cloud_buckets):
+            await adapter.upload_file(bucket_name, path)
+            downloads.append(await adapter.download_bytes(cloud_bucket))
+    elapsed = time.perf_counter() - start_time
+
+    for path, data in zip(paths, downloads):
+        with open(path, 'rb') as file:
+            if file.read() != data:
+                raise AssertionError(f"Round trip mismatch for {path}")
+    return elapsed
+
+
+async def run(args):
+    adapter = GCPAdapter()
+    bucket = adapter.client.bucket(args.bucket)
+    if not bucket.exists():
+        adapter.client.create_bucket(args.bucket)
+
+    with tempfile.TemporaryDirectory() as directory_path:
+        paths = []
+        for index in range(args.files):
+            path = os.path.join(directory_path, f'image-{index}.jpg')
+            with open(path, 'wb') as file:
+                file.write(os.urandom(args.size * 1024))
+            paths.append(path)
+
+        serial_time = await transfer(adapter, args.bucket, paths, concurrent=False)
+        concurrent_time = await transfer(adapter, args.bucket, paths, concurrent=True)
+
+    print(f'{args.files} files x {args.size} KB, round trip verified')
+    print(f'    serial: {serial_time:.2f} s')
+    print(f'concurrent: {concurrent_time:.2f} s ({config.gcs_max_workers} workers), speedup {serial_time / concurrent_time:.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bucket', default='gcs-adapter-check')
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--size', type=int, default=200, help='file size in KB')
+    args = parser.parse_args()
+
+    if not config.gcs_emulator_host:
+        parser.error('STORAGE_EMULATOR_HOST is not set, refusing to run against real GCS')
+
+    asyncio.run(run(args))
+    gcs_executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+PDF extraction benchmark
+Compares serial and page-parallel (process pool) image extraction on a synthetic PDF.
+usage: python -m app.core.my.benchmarks.pdf_extraction_benchmark --pages 200 --workers 4
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from app.core.cpu_executor import CpuExecutor
+from app.core.my.extractors.pdf_image_extractor import PdfImageExtractor
+
+
+def make_image(width, height, seed) -> bytes:
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2 + rng.normal(0, 12, (height, width))
+    pixels = np.stack([base, base[::-1], np.roll(base, width // 3, axis=1)], axis=-1)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def make_pdf(path, pages, images_per_page) -> None:
+    # a repeated logo on every page plus unique photos, like an OM brochure template
+    logo = make_image(400, 200, 0)
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        page.insert_image(fitz.Rect(20, 20, 220, 120), stream=logo)
+        for image_index in range(images_per_page):
+            top = 140 + image_index * 200
+            page.insert_image(fitz.Rect(20, top, 420, top + 180), stream=make_image(1000, 700, page_number * 10 + image_index + 1))
+    document.save(path)
+
+
+async def run(path, image_directory_path, parallel, workers, executor) -> float:
+    extractor = PdfImageExtractor(parallel_workers=workers, executor=executor)
+    start_time = time.perf_counter()
+    images = await extractor.process_file(path, image_directory_path, parallel=parallel)
+    elapsed = time.perf_counter() - start_time
+    print(f'{"parallel" if parallel else "serial":>8}: {elapsed:.2f} s, {len(images)} images, {extractor.stats.to_dict()}')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--images-per-page', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    executor = CpuExecutor(kind='process', max_workers=args.workers)
+    with tempfile.TemporaryDirectory() as directory_path:
+        path = os.path.join(directory_path, 'synthetic.pdf')
+        print(f'Generating {args.pages}-page PDF...')
+        make_pdf(path, args.pages, args.images_per_page)
+
+        serial_time = asyncio.run(run(path, directory_path, False, args.workers, executor))
+        parallel_time = asyncio.run(run(path, directory_path, True, args.workers, executor))
+    executor.shutdown()
+
+    print(f'speedup with {args.workers} workers: {serial_time / parallel_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
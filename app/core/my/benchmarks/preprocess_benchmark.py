@@ -0,0 +1,75 @@
+"""
+Preprocessing micro-benchmark
+Compares the per-image float64 preprocessing with the float32 batch preprocessor (draft decoding, preallocated buffer).
+usage: python -m app.core.my.benchmarks.preprocess_benchmark --images 200 --size 1600x1200
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.core.my.classifiers.real_estate_image_classifier import preprocess_batch
+from app.core.my.extractors.pdf_image_extractor import ImageSize
+
+
+def legacy_preprocess_image(image_bytes, img_height, img_width):
+    img = Image.open(io.BytesIO(image_bytes))
+    img = img.convert('L')
+    img = img.resize((img_height, img_width))
+    img_array = np.array(img)
+    img_array = img_array / 255.0
+    img_array = img_array.reshape((1, img_height, img_width, 1))
+    return img_array
+
+
+def make_jpeg(width, height, seed) -> bytes:
+    # smooth gradients plus noise compress roughly like photos
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    channels = [base, base[::-1], np.roll(base, width // 3, axis=1)]
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def run_legacy(images, img_height, img_width) -> float:
+    start_time = time.perf_counter()
+    arrays = [legacy_preprocess_image(image_bytes, img_height, img_width) for image_bytes in images]
+    np.concatenate(arrays, axis=0)
+    return time.perf_counter() - start_time
+
+
+def run_batch(images, img_height, img_width) -> float:
+    start_time = time.perf_counter()
+    preprocess_batch([io.BytesIO(image_bytes) for image_bytes in images], img_height, img_width)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--size', default='1600x1200')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    width, height = (int(value) for value in args.size.split('x'))
+    img_height, img_width = ImageSize.HEIGHT.value, ImageSize.WIDTH.value
+
+    print(f'Generating {args.images} JPEG images of {width}x{height}...')
+    images = [make_jpeg(width, height, seed) for seed in range(args.images)]
+
+    legacy_time = min(run_legacy(images, img_height, img_width) for _ in range(args.repeat))
+    batch_time = min(run_batch(images, img_height, img_width) for _ in range(args.repeat))
+
+    print(f'legacy per-image: {legacy_time / args.images * 1000:.3f} ms/image')
+    print(f'batch float32:    {batch_time / args.images * 1000:.3f} ms/image')
+    print(f'speedup:          {legacy_time / batch_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import logging
+
+import numpy as np
+
+
+class KerasBackend:
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.model = None
+
+    def load(self) -> 'KerasBackend':
+        import tensorflow as tf
+
+        self.model = tf.keras.models.load_model(self.model_path)
+        self.model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+        return self
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
+
+
+class TFLiteBackend:
+    # prefers the standalone tflite-runtime package, falls back to the interpreter bundled with tensorflow
+    def __init__(self, model_path: str, num_threads=None):
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        self.interpreter = None
+        self.input_details = None
+        self.output_details = None
+        self.batch_size = None
+
+    def load(self) -> 'TFLiteBackend':
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.interpreter = Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        return self
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if self.batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self.input_details['index'], batch.shape)
+            self.interpreter.allocate_tensors()
+            self.input_details = self.interpreter.get_input_details()[0]
+            self.output_details = self.interpreter.get_output_details()[0]
+            self.batch_size = len(batch)
+
+        self.interpreter.set_tensor(self.input_details['index'], self.quantize(batch))
+        self.interpreter.invoke()
+        return self.dequantize(self.interpreter.get_tensor(self.output_details['index']))
+
+    def quantize(self, batch: np.ndarray) -> np.ndarray:
+        dtype = self.input_details['dtype']
+        if dtype == np.float32:
+            return batch
+        scale, zero_point = self.input_details['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def dequantize(self, output: np.ndarray) -> np.ndarray:
+        if self.output_details['dtype'] == np.float32:
+            return output
+        scale, zero_point = self.output_details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+
+class OnnxBackend:
+    def __init__(self, model_path: str, num_threads=None):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.session = None
+        self.input_name = None
+
+    def load(self) -> 'OnnxBackend':
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        self.session = onnxruntime.InferenceSession(
+            self.model_path, sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        return self
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def create_backend(backend_name: str, model_path: str, num_threads=None):
+    logging.info(f"Loading {backend_name} classifier backend from {model_path}")
+    if backend_name == 'keras':
+        return KerasBackend(model_path).load()
+    if backend_name == 'tflite':
+        return TFLiteBackend(model_path, num_threads).load()
+    if backend_name == 'onnx':
+        return OnnxBackend(model_path, num_threads).load()
+    raise ValueError(f"Unknown classifier backend: {backend_name}")
@@ -0,0 +1,36 @@
+"""
+Real estate classifier export
+Writes a TFLite or ONNX artifact of the keras model, optionally int8-quantized with a calibration set from work_dataset,
+and an accuracy parity report against the keras model, measured on a held-out part of work_dataset, next to it.
+usage: python -m app.core.my.classifiers.export_model --format tflite --quantize
+"""
+import argparse
+import json
+
+from app.core.my.classifiers.real_estate_image_classifier import RealEstateImageClassifier
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite')
+    parser.add_argument('--quantize', action='store_true', help='int8 post-training quantization')
+    parser.add_argument('--output-path', default=None)
+    parser.add_argument('--calibration-dataset-path', default=None)
+    parser.add_argument('--calibration-size', type=int, default=200)
+    parser.add_argument('--evaluation-size', type=int, default=200, help='held-out images for the parity report')
+    args = parser.parse_args()
+
+    classifier = RealEstateImageClassifier()
+    report = classifier.export_model(
+        format=args.format,
+        quantize=args.quantize,
+        output_path=args.output_path,
+        calibration_dataset_path=args.calibration_dataset_path,
+        calibration_size=args.calibration_size,
+        evaluation_size=args.evaluation_size
+    )
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+
+def dhash(image: Image.Image, hash_size=16, min_std=4.0) -> Optional[str]:
+    # difference hash: compares neighbouring pixels of a tiny grayscale thumbnail, robust to re-encoding and rescaling.
+    # flat and low-detail images all collapse to (nearly) the same bits, so they get no hash at all
+    img = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+
+    min_bits = bits.size // 16
+    if pixels.std() < min_std or not min_bits <= bits.sum() <= bits.size - min_bits:
+        return None
+    return f'{int.from_bytes(np.packbits(bits).tobytes(), "big"):0{hash_size * hash_size // 4}x}'
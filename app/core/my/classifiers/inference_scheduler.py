@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import List, Optional
+
+from app.core.config import config
+from app.core.metrics import metrics
+from app.core.my.classifiers.model_registry import model_registry
+from app.core.my.classifiers.real_estate_image_classifier import ImageSource
+
+
+class InferenceRequest:
+    def __init__(self, image: ImageSource):
+        self.image = image
+        self.future = Future()
+
+
+class InferenceScheduler:
+    # collects images from all in-flight requests into shared batches and runs them on one worker thread
+    def __init__(self, max_batch_size=None, max_wait_ms=None):
+        self.max_batch_size = max_batch_size if max_batch_size is not None else config.inference_max_batch_size
+        self.max_wait_ms = max_wait_ms if max_wait_ms is not None else config.inference_max_wait_ms
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='inference-scheduler', daemon=True)
+            self.thread.start()
+            logging.info(f"Inference scheduler started: max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms}")
+
+    def stop(self, timeout=None) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def submit(self, image: ImageSource) -> Future:
+        self.start()
+        request = InferenceRequest(image)
+        self.queue.put(request)
+        return request.future
+
+    async def predict(self, images: List[ImageSource]) -> List[Optional[float]]:
+        futures = [asyncio.wrap_future(self.submit(image)) for image in images]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        scores = []
+        for result in results:
+            if isinstance(result, BaseException):
+                logging.error(f"Error while predicting image in inference scheduler: {result}")
+                scores.append(None)
+            else:
+                scores.append(result)
+        return scores
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            batch = self.collect_batch()
+            if batch:
+                self.process_batch(batch)
+
+        # fails requests that were queued after the scheduler was stopped
+        for request in self.drain():
+            request.future.set_exception(RuntimeError('Inference scheduler stopped'))
+
+    def collect_batch(self) -> List[InferenceRequest]:
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # takes whatever is already queued even when the wait window is over
+                request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+
+        return batch
+
+    def process_batch(self, batch: List[InferenceRequest]) -> None:
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            classifier = model_registry.get_real_estate_classifier()
+            start_time = time.perf_counter()
+            scores = classifier.predict_batch(
+                [request.image for request in batch], batch_size=len(batch)
+            )
+            metrics.observe('inference_batch_ms', (time.perf_counter() - start_time) * 1000)
+            metrics.observe('inference_batch_size', len(batch))
+        except Exception as e:
+            traceback_str = traceback.format_exc()
+            logging.error(f"Error while processing inference batch of {len(batch)} images: {traceback_str}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, score in zip(batch, scores):
+            request.future.set_result(score)
+
+    def drain(self) -> List[InferenceRequest]:
+        requests = []
+        while True:
+            try:
+                requests.append(self.queue.get_nowait())
+            except queue.Empty:
+                return requests
+
+
+inference_scheduler = InferenceScheduler()
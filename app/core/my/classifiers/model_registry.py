@@ -0,0 +1,35 @@
+import logging
+import threading
+import time
+
+from app.core.config import config
+from app.core.my.classifiers.real_estate_image_classifier import RealEstateImageClassifier
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.real_estate_classifier = None
+
+    def get_real_estate_classifier(self) -> RealEstateImageClassifier:
+        if self.real_estate_classifier is None:
+            with self.lock:
+                if self.real_estate_classifier is None:
+                    self.real_estate_classifier = self.load_real_estate_classifier()
+        return self.real_estate_classifier
+
+    def load_real_estate_classifier(self) -> RealEstateImageClassifier:
+        classifier = RealEstateImageClassifier()
+
+        start_time = time.perf_counter()
+        classifier.load_model()
+        logging.info(f"Real estate classifier loaded in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+        start_time = time.perf_counter()
+        classifier.warm_up(batch_size=config.classifier_batch_size)
+        logging.info(f"Real estate classifier warmed up in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+        return classifier
+
+
+model_registry = ModelRegistry()
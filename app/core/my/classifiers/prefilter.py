@@ -0,0 +1,118 @@
+import logging
+from enum import Enum
+from typing import List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import config
+from app.core.metrics import metrics
+from app.core.my.classifiers.real_estate_image_classifier import open_image
+
+
+class PrefilterRule(Enum):
+    MIN_SIDE = 'min_side'
+    ASPECT_RATIO = 'aspect_ratio'
+    UNIFORM = 'uniform'
+    HISTOGRAM_SPREAD = 'histogram_spread'
+    COLOUR_ENTROPY = 'colour_entropy'
+    EDGE_DENSITY = 'edge_density'
+
+
+class ImagePrefilter:
+    # cheap statistics that reject obvious non-photos (strips, blank backgrounds, logos, charts, text scans) before the CNN
+    def __init__(self, rules: List[str] = None, thumbnail_size=None):
+        rules = rules if rules is not None else config.prefilter_rules.split(',')
+        self.rules = [PrefilterRule(rule.strip()) for rule in rules if rule.strip()]
+        self.thumbnail_size = thumbnail_size if thumbnail_size is not None else config.prefilter_thumbnail_size
+        self.min_side = config.prefilter_min_side
+        self.max_aspect_ratio = config.prefilter_max_aspect_ratio
+        self.min_std = config.prefilter_min_std
+        self.min_histogram_spread = config.prefilter_min_histogram_spread
+        self.min_colour_entropy = config.prefilter_min_colour_entropy
+        self.max_edge_density = config.prefilter_max_edge_density
+        self.edge_threshold = config.prefilter_edge_threshold
+
+    def check(self, image: Union[str, bytes, Image.Image]) -> Optional[PrefilterRule]:
+        # returns the first rule that rejects the image, None when the image has to go to the CNN
+        img = open_image(image)
+
+        width, height = img.size
+        if PrefilterRule.MIN_SIDE in self.rules and min(width, height) < self.min_side:
+            return PrefilterRule.MIN_SIDE
+        if PrefilterRule.ASPECT_RATIO in self.rules and max(width, height) / max(1, min(width, height)) > self.max_aspect_ratio:
+            return PrefilterRule.ASPECT_RATIO
+
+        rgb = self.load_thumbnail(img, drafted=img is not image)
+        gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+        for rule in self.rules:
+            if rule == PrefilterRule.UNIFORM and gray.std() < self.min_std:
+                return rule
+            if rule == PrefilterRule.HISTOGRAM_SPREAD and self.histogram_spread(gray) < self.min_histogram_spread:
+                return rule
+            if rule == PrefilterRule.COLOUR_ENTROPY and self.colour_entropy(rgb) < self.min_colour_entropy:
+                return rule
+            if rule == PrefilterRule.EDGE_DENSITY and self.edge_density(gray) > self.max_edge_density:
+                return rule
+        return None
+
+    def load_thumbnail(self, img: Image.Image, drafted=False) -> np.ndarray:
+        if drafted:
+            # the image was opened here, so the JPEG decoder may downscale it while decoding
+            img.draft('RGB', (self.thumbnail_size, self.thumbnail_size))
+        width, height = img.size
+        scale = self.thumbnail_size / max(width, height)
+        if scale < 1:
+            # resize returns a new image, the caller's image is left untouched
+            img = img.resize(
+                (max(1, round(width * scale)), max(1, round(height * scale))), Image.Resampling.BILINEAR, reducing_gap=2.0
+            )
+        return np.asarray(img.convert('RGB'), dtype=np.uint8)
+
+    def histogram_spread(self, gray: np.ndarray) -> float:
+        low, high = np.percentile(gray, [5, 95])
+        return float(high - low)
+
+    def colour_entropy(self, rgb: np.ndarray) -> float:
+        # entropy in bits of a 4-bit per channel colour histogram, flat graphics have only a handful of colours
+        quantized = rgb >> 4
+        indexes = (quantized[..., 0].astype(np.uint16) << 8) | (quantized[..., 1].astype(np.uint16) << 4) | quantized[..., 2]
+        counts = np.bincount(indexes.reshape(-1), minlength=4096)
+        probabilities = counts[counts > 0] / indexes.size
+        return float(-(probabilities * np.log2(probabilities)).sum())
+
+    def edge_density(self, gray: np.ndarray) -> float:
+        gradient = np.abs(np.diff(gray, axis=1))[:-1, :] + np.abs(np.diff(gray, axis=0))[:, :-1]
+        return float((gradient > self.edge_threshold).mean())
+
+    def record(self, rejections: List[Optional[PrefilterRule]]) -> None:
+        # estimates the CNN time saved from the average per-image inference time measured by the scheduler
+        rejected = [rule for rule in rejections if rule is not None]
+        metrics.increment('prefilter_checked', len(rejections))
+        for rule in rejected:
+            metrics.increment(f'prefilter_rejected_{rule.value}')
+        if not rejected:
+            return
+
+        timings = metrics.snapshot()['timings']
+        batch_ms = timings.get('inference_batch_ms', {}).get('sum', 0.0)
+        batch_images = timings.get('inference_batch_size', {}).get('sum', 0.0)
+        if batch_images:
+            metrics.increment('prefilter_cnn_ms_saved', len(rejected) * batch_ms / batch_images)
+        logging.info(f"Prefilter rejected {len(rejected)} of {len(rejections)} images before the CNN")
+
+
+def prefilter_images(images: List[Union[str, bytes, Image.Image]], prefilter: ImagePrefilter) -> List[Optional[PrefilterRule]]:
+    # module level so it can run in a process pool; images that can't be checked are left to the CNN
+    rejections = []
+    for image in images:
+        try:
+            rejections.append(prefilter.check(image))
+        except Exception as e:
+            logging.error(f"Error while prefiltering image {image if isinstance(image, str) else type(image).__name__}: {e}")
+            rejections.append(None)
+    return rejections
+
+
+image_prefilter = ImagePrefilter()
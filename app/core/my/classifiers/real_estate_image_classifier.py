@@ -1,17 +1,20 @@
+import io
+import json
 import logging
 import os
+import threading
 import traceback
 from enum import Enum
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
-import tensorflow as tf
 from PIL import Image
-from matplotlib import pyplot as plt
-from tensorflow.keras.layers import Dense, Conv2D, Flatten, MaxPooling2D, Input
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 from app.core.config import config
+from app.core.my.classifiers.backends import KerasBackend, create_backend
+from app.core.my.classifiers.image_hash import dhash
 from app.core.my.extractors.pdf_image_extractor import ImageSize
+from app.utils.helpers import prep_hash
 
 
 class RealEstateImageClassifierClass(Enum):
@@ -19,19 +22,107 @@ class RealEstateImageClassifierClass(Enum):
     INVALID = 'INVALID'
 
 
-class ModelCallback(tf.keras.callbacks.Callback):
-  def on_epoch_end(self, epoch, logs={}):
-    if logs.get('val_loss') < 0.1 and logs.get('val_accuracy') > 0.9:
-      self.model.stop_training = True
+# image source accepted by the batch API: a file path, encoded image bytes, a decoded PIL image or an already preprocessed array
+ImageSource = Union[str, bytes, Image.Image, np.ndarray]
+
+
+def open_image(image: Union[str, bytes, Image.Image]) -> Image.Image:
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, bytes):
+        return Image.open(io.BytesIO(image))
+    return Image.open(image)
+
+
+def load_grayscale_image(image, img_height, img_width) -> Image.Image:
+    if isinstance(image, Image.Image):
+        # the caller's image may still be needed at full size, so it isn't drafted in place
+        img = image
+    else:
+        img = open_image(image)
+        # lets the JPEG decoder downscale and convert to grayscale while decoding, no-op for other formats
+        img.draft('L', (img_width, img_height))
+    img = img.convert('L')  # grayscale
+    if img.size != (img_height, img_width):
+        img = img.resize((img_height, img_width))
+    return img
+
+
+def preprocess_into(image, out: np.ndarray, img_height, img_width) -> Image.Image:
+    # writes the normalized [0, 1] float32 pixels straight into out, no float64 intermediate
+    img = load_grayscale_image(image, img_height, img_width)
+    pixels = np.asarray(img, dtype=np.uint8).reshape(out.shape)
+    np.multiply(pixels, np.float32(1 / 255), out=out, dtype=np.float32)
+    return img
+
+
+def preprocess_image(image_path, img_height, img_width) -> np.ndarray:
+    # accepts either a file path or an already decoded PIL image
+    img_array = np.empty((1, img_height, img_width, 1), dtype=np.float32) # 1 channel for grayscale
+    preprocess_into(image_path, img_array[0], img_height, img_width)
+    return img_array
+
+
+def preprocess_batch(images: List[ImageSource], img_height, img_width, out: np.ndarray = None) -> Tuple[np.ndarray, List[bool]]:
+    # module level so it can run in a process pool; rows of images that failed to preprocess are flagged False
+    if out is None:
+        out = np.empty((len(images), img_height, img_width, 1), dtype=np.float32)
+
+    processed = []
+    for index, image in enumerate(images):
+        try:
+            if isinstance(image, np.ndarray):
+                out[index] = image.reshape((img_height, img_width, 1))
+            else:
+                preprocess_into(image, out[index], img_height, img_width)
+            processed.append(True)
+        except Exception as e:
+            logging.error(f'Error while preprocessing image {image if isinstance(image, str) else type(image).__name__}: {e}')
+            processed.append(False)
+    return out, processed
+
+
+def preprocess_hashed_batch(images: List[Union[str, bytes, Image.Image]], img_height, img_width) -> Tuple[np.ndarray, List[bool], List[Optional[str]]]:
+    # same as preprocess_batch, plus a perceptual hash of every image computed from the already decoded grayscale image
+    out = np.empty((len(images), img_height, img_width, 1), dtype=np.float32)
+    processed = []
+    hashes = []
+    for index, image in enumerate(images):
+        try:
+            img = preprocess_into(image, out[index], img_height, img_width)
+            hashes.append(dhash(img))
+            processed.append(True)
+        except Exception as e:
+            logging.error(f'Error while preprocessing image {image if isinstance(image, str) else type(image).__name__}: {e}')
+            hashes.append(None)
+            processed.append(False)
+    return out, processed, hashes
+
+
+def create_model_callback():
+    # tensorflow is imported lazily so the tflite/onnx backends don't pay for it
+    import tensorflow as tf
+
+    class ModelCallback(tf.keras.callbacks.Callback):
+      def on_epoch_end(self, epoch, logs={}):
+        if logs.get('val_loss') < 0.1 and logs.get('val_accuracy') > 0.9:
+          self.model.stop_training = True
+
+    return ModelCallback()
 
 
 class RealEstateImageClassifier:
     def __init__(self):
         self.model = None
+        self.model_lock = threading.Lock()
         self.img_height = ImageSize.HEIGHT.value
         self.img_width = ImageSize.WIDTH.value
         self.model_path = os.path.join(config.classifier_path, 'real_estate_images', 'model.keras')
+        self.tflite_model_path = os.path.join(config.classifier_path, 'real_estate_images', 'model.tflite')
+        self.onnx_model_path = os.path.join(config.classifier_path, 'real_estate_images', 'model.onnx')
         self.training_dataset_path = os.path.join(config.classifier_path, 'real_estate_images', 'training_dataset' )
+        self.work_dataset_path = os.path.join(config.classifier_path, 'real_estate_images', 'work_dataset')
+        self.backend_name = config.classifier_backend
 
     def set_image_size(self, img_height: int, img_width: int):
         self.img_height = img_height
@@ -52,22 +143,220 @@ class RealEstateImageClassifier:
             logging.error(traceback_str)
             return False
 
+    def predict_batch(self, images: List[ImageSource], batch_size=32) -> List[Optional[float]]:
+        # returns one score per image, None for images that failed to preprocess
+        model = self.load_model()
+        scores = [None] * len(images)
+        buffer = np.empty((min(batch_size, len(images)), self.img_height, self.img_width, 1), dtype=np.float32)
+
+        for start in range(0, len(images), batch_size):
+            chunk = images[start:start + batch_size]
+            batch, processed = preprocess_batch(
+                chunk, self.img_height, self.img_width, out=buffer[:len(chunk)]
+            )
+            indexes = [start + offset for offset, ok in enumerate(processed) if ok]
+            if not indexes:
+                continue
+
+            if len(indexes) < len(chunk):
+                batch = batch[[index - start for index in indexes]]
+
+            with self.model_lock:
+                predictions = model.predict(batch)
+            for index, prediction in zip(indexes, predictions.reshape(-1)):
+                scores[index] = float(prediction)
+
+        return scores
+
+    def classify_batch(self, images: List[ImageSource], batch_size=32, threshold=0.5) -> List[RealEstateImageClassifierClass]:
+        try:
+            scores = self.predict_batch(images, batch_size=batch_size)
+        except Exception as e:
+            logging.error(f'Error while predicting real estate images batch: {e}')
+            traceback_str = traceback.format_exc()
+            logging.error(traceback_str)
+            scores = [None] * len(images)
+
+        return [self.score_to_class(score, threshold) for score in scores]
+
+    def score_to_class(self, score: Optional[float], threshold=0.5) -> RealEstateImageClassifierClass:
+        if score is not None and score > threshold:
+            return RealEstateImageClassifierClass.REAL_ESTATE
+        return RealEstateImageClassifierClass.INVALID
+
+    def is_real_estate_score(self, score: Optional[float], threshold=0.5) -> bool:
+        return self.score_to_class(score, threshold) == RealEstateImageClassifierClass.REAL_ESTATE
+
+    def are_real_estate_images(self, images: List[ImageSource], batch_size=32) -> List[bool]:
+        return [
+            image_class == RealEstateImageClassifierClass.REAL_ESTATE
+            for image_class in self.classify_batch(images, batch_size=batch_size)
+        ]
+
     def preprocess_image(self, image_path):
-        img = Image.open(image_path)
-        img = img.convert('L')  # grayscale
-        img = img.resize((self.img_height, self.img_width))
-        img_array = np.array(img)
-        img_array = img_array / 255.0 # normalizing [0, 1]
-        img_array = img_array.reshape((1, self.img_height, self.img_width, 1)) # 1 channel for grayscale
-        return img_array
+        return preprocess_image(image_path, self.img_height, self.img_width)
 
     def load_model(self):
+        # returns the configured inference backend, all backends expose predict(batch)
         if self.model is None:
-            self.model = tf.keras.models.load_model(self.model_path)
-            self.model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+            with self.model_lock:
+                if self.model is None:
+                    self.model = create_backend(
+                        self.backend_name, self.get_backend_model_path(self.backend_name), config.classifier_backend_threads
+                    )
         return self.model
 
+    def get_model_version(self) -> str:
+        # cached verdicts are only valid for the model that produced them
+        if config.classifier_model_version:
+            return config.classifier_model_version
+        stat = os.stat(self.get_backend_model_path(self.backend_name))
+        return f'{self.backend_name}-{prep_hash(f"{stat.st_size}:{stat.st_mtime_ns}")[:12]}'
+
+    def get_backend_model_path(self, backend_name: str) -> str:
+        if backend_name == 'tflite':
+            return self.tflite_model_path
+        if backend_name == 'onnx':
+            return self.onnx_model_path
+        return self.model_path
+
+    def warm_up(self, batch_size=1):
+        # builds the predict function with a dummy forward pass so the first real request doesn't pay for it
+        model = self.load_model()
+        dummy_batch = np.zeros((batch_size, self.img_height, self.img_width, 1), dtype=np.float32)
+        with self.model_lock:
+            model.predict(dummy_batch)
+
+    def export_model(self, format='tflite', quantize=False, output_path=None, calibration_dataset_path=None, calibration_size=200, evaluation_size=200) -> dict:
+        # exports the keras model to tflite/onnx, optionally int8-quantized, and writes an accuracy parity report next to it
+        # the report is measured on held-out images, never on the ones the quantizer calibrated on
+        if output_path is None:
+            output_path = self.get_backend_model_path(format)
+        if calibration_dataset_path is None:
+            calibration_dataset_path = self.work_dataset_path
+
+        keras_backend = KerasBackend(self.model_path).load()
+        (calibration_batch, _), (evaluation_batch, evaluation_labels) = self.load_calibration_dataset(
+            calibration_dataset_path, calibration_size, evaluation_size
+        )
+        if quantize and not len(calibration_batch):
+            raise ValueError(f'Calibration dataset {calibration_dataset_path} is empty, int8 quantization needs sample images')
+
+        if format == 'tflite':
+            self.export_tflite(keras_backend.model, output_path, calibration_batch if quantize else None)
+        elif format == 'onnx':
+            self.export_onnx(keras_backend.model, output_path, calibration_batch if quantize else None)
+        else:
+            raise ValueError(f'Unknown export format: {format}')
+
+        exported_backend = create_backend(format, output_path, config.classifier_backend_threads)
+        report = self.build_parity_report(keras_backend, exported_backend, evaluation_batch, evaluation_labels)
+        report.update({
+            'format': format, 'quantized': quantize, 'model_path': output_path, 'calibration_samples': len(calibration_batch)
+        })
+
+        with open(f'{os.path.splitext(output_path)[0]}.report.json', 'w') as file:
+            json.dump(report, file, indent=4)
+        logging.info(f'Exported real estate classifier: {report}')
+        return report
+
+    def export_tflite(self, model, output_path, calibration_batch=None) -> None:
+        import tensorflow as tf
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if calibration_batch is not None:
+            def representative_dataset():
+                for img_array in calibration_batch:
+                    yield [img_array[np.newaxis]]
+
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        with open(output_path, 'wb') as file:
+            file.write(converter.convert())
+
+    def export_onnx(self, model, output_path, calibration_batch=None) -> None:
+        import tensorflow as tf
+        import tf2onnx
+
+        input_signature = [tf.TensorSpec((None, self.img_height, self.img_width, 1), tf.float32, name='input')]
+        float_model_path = f'{os.path.splitext(output_path)[0]}.float.onnx' if calibration_batch is not None else output_path
+        tf2onnx.convert.from_keras(model, input_signature=input_signature, output_path=float_model_path)
+
+        if calibration_batch is not None:
+            from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+
+            class CalibrationReader(CalibrationDataReader):
+                def __init__(self):
+                    self.samples = iter(calibration_batch)
+
+                def get_next(self):
+                    img_array = next(self.samples, None)
+                    return None if img_array is None else {'input': img_array[np.newaxis]}
+
+            quantize_static(
+                float_model_path, output_path, CalibrationReader(),
+                activation_type=QuantType.QInt8, weight_type=QuantType.QInt8
+            )
+            os.remove(float_model_path)
+
+    def load_calibration_dataset(self, dataset_path, calibration_size=200, evaluation_size=200) -> Tuple[Tuple[np.ndarray, List[Optional[int]]], Tuple[np.ndarray, List[Optional[int]]]]:
+        # work_dataset keeps classified images in real_estate/invalid folders, the folder is used as the label
+        labels = {'real_estate': 1, 'invalid': 0}
+        image_paths = []
+        image_labels = []
+        for folder in sorted(os.listdir(dataset_path)) if os.path.isdir(dataset_path) else []:
+            folder_path = os.path.join(dataset_path, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for file_name in sorted(os.listdir(folder_path)):
+                image_paths.append(os.path.join(folder_path, file_name))
+                image_labels.append(labels.get(folder))
+
+        # spreads the sample evenly over both classes instead of taking the first folder only, then deals it out
+        # alternately so the calibration and evaluation sets are disjoint and both cover every folder
+        sample_size = calibration_size + evaluation_size
+        step = max(1, len(image_paths) // max(1, sample_size))
+        image_paths = image_paths[::step][:sample_size]
+        image_labels = image_labels[::step][:sample_size]
+        ratio = calibration_size / max(1, sample_size)
+        calibration_indexes = [index for index in range(len(image_paths)) if int((index + 1) * ratio) > int(index * ratio)]
+        evaluation_indexes = sorted(set(range(len(image_paths))) - set(calibration_indexes))
+
+        def load(indexes):
+            batch, processed = preprocess_batch([image_paths[index] for index in indexes], self.img_height, self.img_width)
+            return batch[processed], [image_labels[index] for index, ok in zip(indexes, processed) if ok]
+
+        return load(calibration_indexes), load(evaluation_indexes)
+
+    def build_parity_report(self, reference_backend, exported_backend, batch: np.ndarray, labels: List[Optional[int]], threshold=0.5) -> dict:
+        if not len(batch):
+            return {'samples': 0}
+
+        reference_scores = reference_backend.predict(batch).reshape(-1)
+        exported_scores = exported_backend.predict(batch).reshape(-1)
+        differences = np.abs(reference_scores - exported_scores)
+        report = {
+            'samples': len(batch),
+            'max_abs_diff': float(differences.max()),
+            'mean_abs_diff': float(differences.mean()),
+            'class_agreement': float(np.mean((reference_scores > threshold) == (exported_scores > threshold))),
+        }
+
+        labeled = [index for index, label in enumerate(labels) if label is not None]
+        if labeled:
+            label_array = np.array([labels[index] for index in labeled])
+            report['reference_accuracy'] = float(np.mean((reference_scores[labeled] > threshold) == label_array))
+            report['exported_accuracy'] = float(np.mean((exported_scores[labeled] > threshold) == label_array))
+        return report
+
     def create_model(self):
+        import tensorflow as tf
+        from tensorflow.keras.layers import Dense, Conv2D, Flatten, MaxPooling2D
+
         model = tf.keras.models.Sequential([
             Conv2D(16, (3, 3), activation='relu', input_shape=(self.img_height, self.img_width, 1)), # 1 channel for grayscale
             MaxPooling2D(2, 2),
@@ -81,6 +370,8 @@ class RealEstateImageClassifier:
         return model
 
     def train_the_model(self, training_dataset_path=None, model_path=None, plot_training_history=False):
+        from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
         if training_dataset_path is None:
             training_dataset_path = self.training_dataset_path
 
@@ -129,7 +420,7 @@ class RealEstateImageClassifier:
 
     def fit_model(self, model, train_data_generator, validation_data_generator, epochs=20):
         print('Training model...')
-        callbacks = ModelCallback()
+        callbacks = create_model_callback()
         history = model.fit(
             train_data_generator,
             epochs=epochs,
@@ -139,6 +430,8 @@ class RealEstateImageClassifier:
         return history
 
     def plot_history(self, history):
+        from matplotlib import pyplot as plt
+
         acc = history.history['accuracy']
         val_acc = history.history['val_accuracy']
         loss = history.history['loss']
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from app.core.config import config
+from app.core.metrics import metrics
+from app.infrastructure.adapters.mongo_async_adapter import MongoAsyncAdapter
+
+
+class FileVerdictStore:
+    # JSON lines: a header with the model version, then one [image_hash, entry] line per saved verdict.
+    # Saves append the dirty entries only; the file is rewritten with the current LRU once it holds
+    # twice as many lines as there are entries. The last occurrence of a hash decides its LRU position
+    def __init__(self, path: str):
+        self.path = path
+        self.model_version = None
+        self.line_count = 0
+
+    async def load(self, model_version: str, max_size: int) -> Dict[str, dict]:
+        return await asyncio.to_thread(self.read, model_version, max_size)
+
+    async def save(self, model_version: str, entries: Dict[str, dict], dirty_keys: List[str]) -> None:
+        if self.model_version != model_version or self.line_count >= 2 * len(entries) or not os.path.exists(self.path):
+            await asyncio.to_thread(self.write, model_version, entries)
+        else:
+            await asyncio.to_thread(self.append, [(key, entries[key]) for key in dirty_keys if key in entries])
+
+    def read(self, model_version: str, max_size: int) -> Dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        entries = OrderedDict()
+        with open(self.path, 'r') as file:
+            header = json.loads(file.readline() or '{}')
+            if header.get('model_version') != model_version:
+                logging.info(f"Verdict cache {self.path} belongs to another model version, starting empty")
+                return {}
+            # a file of the earlier format holds the whole LRU in its header
+            entries.update(header.get('entries', []))
+            line_count = 1
+            for line in file:
+                line_count += 1
+                try:
+                    image_hash, entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash during an append
+                    continue
+                entries[image_hash] = entry
+                entries.move_to_end(image_hash)
+        # a file of the earlier format is rewritten by the first save instead of being appended to
+        self.model_version = model_version if 'entries' not in header else None
+        self.line_count = line_count
+        return dict(list(entries.items())[-max_size:])
+
+    def write(self, model_version: str, entries: Dict[str, dict]) -> None:
+        # a unique temporary file, so a rewrite never shares its file with another one
+        directory_path = os.path.dirname(self.path) or '.'
+        with tempfile.NamedTemporaryFile('w', dir=directory_path, suffix='.tmp', delete=False) as file:
+            try:
+                file.write(json.dumps({'model_version': model_version}) + '\n')
+                for item in entries.items():
+                    file.write(json.dumps(item) + '\n')
+            except BaseException:
+                os.remove(file.name)
+                raise
+        os.replace(file.name, self.path)
+        self.model_version = model_version
+        self.line_count = len(entries) + 1
+
+    def append(self, items: List[tuple]) -> None:
+        with open(self.path, 'a') as file:
+            file.write(''.join(json.dumps(item) + '\n' for item in items))
+        self.line_count += len(items)
+
+
+class MongoVerdictStore:
+    def __init__(self, max_size: int, collection_name='image-verdicts'):
+        self.max_size = max_size
+        self.adapter = MongoAsyncAdapter(collection_name)
+
+    async def load(self, model_version: str, max_size: int) -> Dict[str, dict]:
+        async with self.adapter as adapter:
+            docs = await adapter.find_documents(
+                {'model_version': model_version},
+                projection={'_id': 0, 'image_hash': 1, 'score': 1, 'verdict': 1},
+                sort=[('last_used_at', -1)],
+                limit=max_size
+            )
+        return {doc['image_hash']: {'score': doc['score'], 'verdict': doc['verdict']} for doc in reversed(docs)}
+
+    async def save(self, model_version: str, entries: Dict[str, dict], dirty_keys: List[str]) -> None:
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {'model_version': model_version, 'image_hash': key},
+                {'$set': {**entries[key], 'last_used_at': now}},
+                upsert=True
+            )
+            for key in dirty_keys if key in entries
+        ]
+        if not operations:
+            return
+
+        async with self.adapter as adapter:
+            await adapter.bulk_write(operations, ordered=False)
+            await self.trim(adapter, model_version)
+
+    async def trim(self, adapter: MongoAsyncAdapter, model_version: str) -> None:
+        # evicts the least recently used verdicts beyond the cache size
+        count = await adapter.count_documents({'model_version': model_version})
+        if count <= self.max_size:
+            return
+        docs = await adapter.find_documents(
+            {'model_version': model_version}, projection={'_id': 1}, sort=[('last_used_at', 1)], limit=count - self.max_size
+        )
+        await adapter.delete_as_many({'_id': {'$in': [doc['_id'] for doc in docs]}})
+
+
+class VerdictCache:
+    # maps a perceptual hash of an image to the classifier verdict, so repeated stock photos and logos skip the CNN
+    def __init__(self, store=None, max_size=None, flush_every=None):
+        self.max_size = max_size if max_size is not None else config.verdict_cache_max_size
+        self.store = store if store is not None else self.create_store()
+        self.flush_every = flush_every if flush_every is not None else config.verdict_cache_flush_every
+        self.entries = OrderedDict()
+        self.dirty_keys = set()
+        self.model_version = None
+        self.lock = asyncio.Lock()
+        # one save at a time: a slow save must not overlap the next one
+        self.flush_lock = asyncio.Lock()
+
+    def create_store(self):
+        if config.verdict_cache_backend == 'mongo':
+            return MongoVerdictStore(self.max_size)
+        if config.verdict_cache_backend == 'file':
+            return FileVerdictStore(config.verdict_cache_path)
+        raise ValueError(f"Unknown verdict cache backend: {config.verdict_cache_backend}")
+
+    async def load(self, model_version: str) -> None:
+        if self.model_version == model_version:
+            return
+        async with self.lock:
+            if self.model_version == model_version:
+                return
+            try:
+                entries = await self.store.load(model_version, self.max_size)
+            except Exception as e:
+                logging.error(f"Error while loading verdict cache: {e}")
+                entries = {}
+            self.entries = OrderedDict(entries)
+            self.dirty_keys = set()
+            self.model_version = model_version
+            logging.info(f"Verdict cache loaded for model {model_version}: {len(self.entries)} entries")
+
+    async def get_many(self, model_version: str, image_hashes: List[Optional[str]]) -> List[Optional[dict]]:
+        await self.load(model_version)
+        results = []
+        for image_hash in image_hashes:
+            entry = self.entries.get(image_hash) if image_hash is not None else None
+            if entry is not None:
+                # hits are saved again too, so the persisted last_used_at (and trimming) follows real use
+                self.entries.move_to_end(image_hash)
+                self.dirty_keys.add(image_hash)
+            results.append(entry)
+
+        hits = sum(1 for entry in results if entry is not None)
+        metrics.increment('verdict_cache_hits', hits)
+        metrics.increment('verdict_cache_misses', len(results) - hits)
+        self.update_hit_rate()
+        if self.should_flush():
+            await self.flush()
+        return results
+
+    async def set_many(self, model_version: str, verdicts: Dict[str, dict]) -> None:
+        await self.load(model_version)
+        for image_hash, entry in verdicts.items():
+            self.entries[image_hash] = entry
+            self.entries.move_to_end(image_hash)
+            self.dirty_keys.add(image_hash)
+
+        while len(self.entries) > self.max_size:
+            evicted_hash, _ = self.entries.popitem(last=False)
+            self.dirty_keys.discard(evicted_hash)
+            metrics.increment('verdict_cache_evictions')
+
+        metrics.set_gauge('verdict_cache_size', len(self.entries))
+        if self.should_flush():
+            await self.flush()
+
+    def should_flush(self) -> bool:
+        # while a save is running the dirty keys keep piling up, the next lookup after it saves them
+        return len(self.dirty_keys) >= self.flush_every and not self.flush_lock.locked()
+
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.dirty_keys or self.model_version is None:
+                return
+            dirty_keys = list(self.dirty_keys)
+            self.dirty_keys = set()
+            try:
+                await self.store.save(self.model_version, OrderedDict(self.entries), dirty_keys)
+            except Exception as e:
+                traceback_str = traceback.format_exc()
+                logging.error(f"Error while saving verdict cache: {traceback_str}")
+                self.dirty_keys.update(dirty_keys)
+
+    def update_hit_rate(self) -> None:
+        hits = metrics.get_counter('verdict_cache_hits')
+        total = hits + metrics.get_counter('verdict_cache_misses')
+        metrics.set_gauge('verdict_cache_hit_rate', hits / total if total else 0.0)
+
+
+verdict_cache = VerdictCache()
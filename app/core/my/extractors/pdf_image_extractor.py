@@ -1,17 +1,23 @@
+import asyncio
 import io
 import logging
 import os
 import shutil
+import tempfile
+import threading
+import time
 import traceback
 from enum import Enum
-from typing import Callable, List
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple, Union
 import aiofiles
 
 import fitz
 from PIL import Image
 
 from app.core.config import config
-from app.utils.helpers import gen_kebab_name, prep_hash
+from app.core.cpu_executor import CpuExecutor
+from app.core.metrics import metrics
+from app.utils.helpers import gen_kebab_name, get_digest_func
 
 
 class ImageSize(Enum):
@@ -22,15 +28,226 @@ class ImageSize(Enum):
 # function must take two arguments: page_number, image_index
 FileNameFunction = Callable[[int, int], str]
 
+# separates the content digest from the unique part of content-addressed image names
+CONTENT_NAME_SEPARATOR = '_'
 
-class PdfImageExtractor:
+
+class ExtractedImage:
+    # image kept in memory; path is where it is written if it's ever needed on disk.
+    # image_bytes holds the original JPEG when it was passed through without re-encoding
+    def __init__(self, name: str, path: str, image: Image.Image = None, page_number: int = None, image_index: int = None, image_bytes: bytes = None):
+        self.name = name
+        self.path = path
+        self.image = image
+        self.page_number = page_number
+        self.image_index = image_index
+        self.image_bytes = image_bytes
+
+    def get_source(self) -> Union[Image.Image, bytes]:
+        # encoded bytes let the classifier decode a reduced-size draft instead of the full image
+        return self.image_bytes if self.image_bytes is not None else self.image
+
+    def to_bytes(self, format='JPEG') -> bytes:
+        if self.image_bytes is not None and format == 'JPEG':
+            return self.image_bytes
+        image = self.image if self.image is not None else Image.open(io.BytesIO(self.image_bytes))
+        buffer = io.BytesIO()
+        image.save(buffer, format=format)
+        return buffer.getvalue()
+
+
+class PdfSource:
+    # PDF held in memory, or spilled to a temporary file when it's too large; a plain path is accepted as well
+    def __init__(self, name: str, data: bytes = None, path: str = None, temporary=False):
+        self.name = name
+        self.data = data
+        self.path = path
+        self.temporary = temporary
+
+    @classmethod
+    def from_path(cls, path: str) -> 'PdfSource':
+        return cls(os.path.basename(path), path=path)
+
+    def open(self) -> fitz.Document:
+        if self.data is not None:
+            return fitz.open(stream=self.data, filetype='pdf')
+        return fitz.open(self.path)
+
+    def to_file(self, directory: str = None) -> 'PdfSource':
+        # process pool workers get a path instead of a pickled copy of the whole PDF each
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.pdf', delete=False) as file:
+            file.write(self.data)
+        return PdfSource(self.name, path=file.name, temporary=True)
+
+    def close(self) -> None:
+        # the in-memory buffer is released and a spilled temporary file is removed
+        self.data = None
+        if self.temporary and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ExtractionMode(str, Enum):
+    # embedded image objects, or photo regions cropped out of rendered pages (tiled, masked or composited photos)
+    IMAGES = 'images'
+    RENDER = 'render'
+
+
+class RenderOptions:
+    # regions are rendered at the DPI that gives target_size pixels on the long side, within [min_dpi, max_dpi]
+    def __init__(self, max_dpi: int = 150, min_dpi: int = 72, target_size: int = 1024, jpeg_quality: int = 90):
+        self.max_dpi = max_dpi
+        self.min_dpi = min_dpi
+        self.target_size = target_size
+        self.jpeg_quality = jpeg_quality
+
+    @classmethod
+    def from_config(cls) -> 'RenderOptions':
+        return cls(
+            config.pdf_render_max_dpi, config.pdf_render_min_dpi, config.pdf_render_target_size, config.pdf_render_jpeg_quality
+        )
+
+
+class StopReason(str, Enum):
+    TIME_BUDGET = 'time_budget'
+    MAX_PAGES = 'max_pages'
+    MAX_IMAGES = 'max_images'
+
+
+class ExtractionBudget:
+    # per-document limits, 0 means unlimited; oversized images are skipped, the other limits stop extraction
+    def __init__(self, max_seconds: float = 0, max_pages: int = 0, max_image_pixels: int = 0, max_images: int = 0):
+        self.max_seconds = max_seconds
+        self.max_pages = max_pages
+        self.max_image_pixels = max_image_pixels
+        self.max_images = max_images
+
+    @classmethod
+    def from_config(cls) -> 'ExtractionBudget':
+        return cls(
+            config.pdf_max_seconds, config.pdf_max_pages, config.pdf_max_image_pixels, config.pdf_max_images
+        )
+
+
+class ExtractionClock:
+    # counts only the time spent extracting: it's paused while extraction waits for the consumer,
+    # so slow classification and upload downstream don't use up the time budget
+    def __init__(self, max_seconds: float = 0):
+        self.max_seconds = max_seconds
+        self.elapsed = 0.0
+        self.started_at = None
+
+    def start(self) -> None:
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+    def pause(self) -> None:
+        if self.started_at is not None:
+            self.elapsed += time.perf_counter() - self.started_at
+            self.started_at = None
+
+    def get_elapsed(self) -> float:
+        started_at = self.started_at
+        return self.elapsed + (time.perf_counter() - started_at if started_at is not None else 0.0)
+
+    def remaining(self) -> Optional[float]:
+        if not self.max_seconds:
+            return None
+        return max(0.0, self.max_seconds - self.get_elapsed())
+
+    def exceeded(self) -> bool:
+        return bool(self.max_seconds) and self.get_elapsed() > self.max_seconds
+
+
+class ImageDedupIndex:
+    # digests of the images already extracted for a property, shared by all of its PDFs;
+    # a digest found in this run stays pending (by image path) until its image is settled, i.e. classified and
+    # uploaded if valid. new_digests are the settled ones, only those are persisted once the property is processed
+    def __init__(self, digests=()):
+        self.digests = set(digests)
+        self.pending = {}
+        self.new_digests = set()
+
+    def __contains__(self, digest: bytes) -> bool:
+        return digest in self.digests
+
+    def __len__(self) -> int:
+        return len(self.digests)
+
+    def add(self, digest: bytes) -> None:
+        self.digests.add(digest)
+
+    def track(self, image_path: str, digest: bytes) -> None:
+        self.pending[image_path] = digest
+
+    def settle(self, image_path: str) -> None:
+        digest = self.pending.pop(image_path, None)
+        if digest is not None:
+            self.new_digests.add(digest)
+
+
+class ExtractionStats:
     def __init__(self):
+        self.images_seen = 0
+        self.skipped_by_size = 0
+        self.skipped_by_pixels = 0
+        self.duplicate_xrefs = 0
+        self.duplicates = 0
+        self.known_duplicates = 0
+        self.written = 0
+        self.errors = 0
+        # set when a budget limit stopped the extraction and the results are partial
+        self.stop_reason: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def merge(self, other: 'ExtractionStats') -> None:
+        for name, value in other.__dict__.items():
+            if name == 'stop_reason':
+                self.stop_reason = self.stop_reason or value
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+
+class PageImage:
+    # image accepted on a page, before it is written or handed over in memory
+    def __init__(self, page_number: int, image_index: int, image_key: tuple, image: Image.Image = None, image_bytes: bytes = None):
+        self.page_number = page_number
+        self.image_index = image_index
+        self.image_key = image_key
+        self.image = image
+        self.image_bytes = image_bytes
+
+
+class PdfImageExtractor:
+    def __init__(self, parallel_workers=None, executor: CpuExecutor = None, budget: ExtractionBudget = None, mode: ExtractionMode = None, render_options: RenderOptions = None):
         self.min_image_height = ImageSize.HEIGHT.value
         self.min_image_width = ImageSize.WIDTH.value
         self.default_image_directory_path = config.pdf_images_path
+        self.mode = ExtractionMode(mode if mode is not None else config.pdf_extraction_mode)
+        self.parallel_workers = parallel_workers if parallel_workers is not None else config.pdf_extraction_workers
+        if parallel_workers is None and not self.parallel_workers and self.mode == ExtractionMode.RENDER:
+            # rendering is CPU-bound on every page, unless configured otherwise it gets a worker per CPU
+            self.parallel_workers = os.cpu_count() or 1
+        self.executor = executor if executor is not None else pdf_extraction_executor
+        self.parallel_min_pages = config.pdf_extraction_parallel_min_pages
+        self.budget = budget if budget is not None else ExtractionBudget.from_config()
+        self.render_options = render_options if render_options is not None else RenderOptions.from_config()
+        self.content_names = config.image_key_scheme == 'content'
+        # stats of the last processed file
+        self.stats = ExtractionStats()
 
-    async def process_file(self, file_path, image_directory_path=None, file_name_func: FileNameFunction = None) -> List[str]:
-        if not file_path.endswith(".pdf"):
+    async def process_file(self, file_path: Union[str, PdfSource], image_directory_path=None, file_name_func: FileNameFunction = None, in_memory=False, parallel=None, dedup_index: ImageDedupIndex = None) -> List[Union[str, ExtractedImage]]:
+        return [
+            image async for image in self.iter_images(
+                file_path, image_directory_path, file_name_func, in_memory=in_memory, parallel=parallel, dedup_index=dedup_index
+            )
+        ]
+
+    async def iter_images(self, file_path: Union[str, PdfSource], image_directory_path=None, file_name_func: FileNameFunction = None, in_memory=False, parallel=None, queue_size=None, dedup_index: ImageDedupIndex = None) -> AsyncIterator[Union[str, ExtractedImage]]:
+        # yields every accepted image as soon as it is extracted, so classification and upload can start right away
+        source = file_path if isinstance(file_path, PdfSource) else PdfSource.from_path(file_path)
+        if not source.name.endswith(".pdf"):
             raise Exception("PDF file extension must be '.pdf'")
 
         if file_name_func is None:
@@ -39,42 +256,200 @@ class PdfImageExtractor:
         if image_directory_path is None:
             image_directory_path = self.default_image_directory_path
 
-        pdf_document = fitz.open(file_path)
-        seen_hashes = set()
-        created_image_paths = []
-
-        for page_number in range(len(pdf_document)):
-            page = pdf_document.load_page(page_number)
-            images = page.get_images(full=True)
-            for img_index, img in enumerate(images):
-                try:
-                    xref = img[0]
-                    base_image = pdf_document.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image_hash = prep_hash(image_bytes)
-
-                    if image_hash in seen_hashes:
-                        logging.warning(f"Duplicate image detected on page {page_number}, image {img_index}. Skipping...")
+        if queue_size is None:
+            queue_size = config.pdf_extraction_queue_size
+
+        stats = ExtractionStats()
+        self.stats = stats
+        clock = ExtractionClock(self.budget.max_seconds)
+        # images known from other PDFs of the property are skipped before they are decoded
+        known_digests = frozenset(dedup_index.digests) if dedup_index is not None else frozenset()
+
+        pdf_document = source.open()
+        page_count = len(pdf_document)
+        if self.budget.max_pages and page_count > self.budget.max_pages:
+            page_count = self.budget.max_pages
+            stats.stop_reason = StopReason.MAX_PAGES.value
+
+        if parallel is None:
+            # rendering costs much more per page, so it goes to the worker pool as soon as there's more than one page
+            # and more than one worker (a single CPU keeps it serial)
+            min_pages = 2 if self.mode == ExtractionMode.RENDER else self.parallel_min_pages
+            parallel = self.parallel_workers > 1 and page_count >= min_pages
+
+        worker_source = None
+        if parallel:
+            pdf_document.close()
+            worker_source = source
+            if source.data is not None:
+                worker_source = await asyncio.to_thread(source.to_file, config.downloads_path)
+            page_images = self.iter_pages_parallel(worker_source, page_count, stats, clock, known_digests)
+        else:
+            page_images = self.iter_pages_serial(pdf_document, page_count, stats, not in_memory, queue_size, clock, known_digests)
+
+        try:
+            async for page_image in page_images:
+                if self.budget.max_images and stats.written >= self.budget.max_images:
+                    stats.stop_reason = StopReason.MAX_IMAGES.value
+                    break
+                if dedup_index is not None:
+                    digest = page_image.image_key[1]
+                    if digest in dedup_index:
+                        stats.known_duplicates += 1
                         continue
+                    dedup_index.add(digest)
+                image = await self.store_page_image(page_image, image_directory_path, file_name_func, in_memory)
+                if dedup_index is not None:
+                    dedup_index.track(image.path if isinstance(image, ExtractedImage) else image, page_image.image_key[1])
+                stats.written += 1
+                yield image
+        finally:
+            await page_images.aclose()
+            if worker_source is not None and worker_source is not source:
+                worker_source.close()
+
+        if stats.stop_reason:
+            metrics.increment(f'pdf_extraction_stopped_{stats.stop_reason}')
+            logging.warning(f"Extraction of {source.name} stopped early ({stats.stop_reason}), results are partial")
+        logging.info(f"Extracted images from {source.name}: {stats.to_dict()}")
+
+    async def store_page_image(self, page_image: PageImage, image_directory_path, file_name_func: FileNameFunction, in_memory) -> Union[str, ExtractedImage]:
+        img_name = file_name_func(page_image.page_number, page_image.image_index)
+        if self.content_names:
+            # '<digest>_<unique name>': the local file stays unique per request, the object key is built from the digest
+            img_name = f'{page_image.image_key[1].hex()}{CONTENT_NAME_SEPARATOR}{img_name}'
+        img_path = os.path.join(image_directory_path, f'{img_name}.jpg')
+
+        if in_memory:
+            # the image stays in memory and is only written if it's needed later
+            return ExtractedImage(
+                img_name, img_path, page_image.image, page_image.page_number, page_image.image_index,
+                image_bytes=page_image.image_bytes
+            )
+
+        async with aiofiles.open(img_path, 'wb') as img_file:
+            await img_file.write(page_image.image_bytes)
+        return img_path
+
+    async def iter_pages_serial(self, pdf_document, page_count: int, stats: ExtractionStats, encode: bool, queue_size: int, clock: ExtractionClock, known_digests: frozenset = frozenset()) -> AsyncIterator[PageImage]:
+        # blocking PyMuPDF/PIL work runs in a producer thread; it takes a free slot before handing an image over,
+        # so it pauses while queue_size images are waiting for the consumer
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        slots = threading.Semaphore(queue_size)
+        stop_event = threading.Event()
+        done = object()
+
+        def hand_over(item) -> bool:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                return True
+            except RuntimeError:
+                # the event loop is already closed
+                return False
 
-                    pil_image = Image.open(io.BytesIO(image_bytes))
-                    if pil_image.mode in ('RGBA', 'P'):
-                        pil_image = convert_rgba_to_rgb(pil_image)
+        def put(item) -> bool:
+            # the clock stops while the producer waits for the consumer to take an image
+            clock.pause()
+            try:
+                while not stop_event.is_set():
+                    if slots.acquire(timeout=0.5):
+                        return hand_over(item)
+                return False
+            finally:
+                clock.start()
 
-                    if pil_image.width > self.min_image_width and pil_image.height > self.min_image_height:
-                        img_name = file_name_func(page_number, img_index)
-                        img_path = os.path.join(image_directory_path, f'{img_name}.jpg')
+        def produce():
+            clock.start()
+            try:
+                for page_image in iter_page_images(
+                    pdf_document, range(page_count), self.min_image_width, self.min_image_height, stats,
+                    self.budget.max_image_pixels, clock, known_digests, self.get_render_options()
+                ):
+                    if encode:
+                        encode_page_image(page_image)
+                    if not put(page_image):
+                        break
+            except Exception as e:
+                hand_over(e)
+            finally:
+                clock.pause()
+                pdf_document.close()
+                hand_over(done)
 
-                        async with aiofiles.open(img_path, 'wb') as img_file:
-                            pil_image.save(img_file, format='JPEG')
+        # producers park in put() while their consumer is slow, so they get their own pool instead of the loop's
+        # default executor that aiofiles and asyncio.to_thread on the consumer side depend on
+        producer = loop.run_in_executor(pdf_producer_executor.get_executor(), produce)
+        try:
+            while True:
+                item = await self.get_queued_item(queue, clock)
+                if item is None:
+                    stats.stop_reason = StopReason.TIME_BUDGET.value
+                    # the producer thread is left to notice the stop event on its own
+                    return
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                slots.release()
+                yield item
+        finally:
+            # stops the producer if the consumer gave up early
+            stop_event.set()
 
-                        created_image_paths.append(img_path)
-                        seen_hashes.add(image_hash)
-                except Exception as e:
-                    traceback_str = traceback.format_exc()
-                    logging.error(f"Exception while processing image {img_index} on page {page_number}: {traceback_str}")
+        await producer
 
-        return created_image_paths
+    async def get_queued_item(self, queue: asyncio.Queue, clock: ExtractionClock):
+        # images already queued are always taken; only waiting on the producer is bounded,
+        # so a single slow page can't hold the consumer past the time budget. None means the budget is used up
+        while True:
+            if not queue.empty():
+                return queue.get_nowait()
+            if clock.exceeded():
+                return None
+            try:
+                return await asyncio.wait_for(queue.get(), clock.remaining())
+            except asyncio.TimeoutError:
+                continue
+
+    async def iter_pages_parallel(self, source: PdfSource, page_count: int, stats: ExtractionStats, clock: ExtractionClock, known_digests: frozenset = frozenset()) -> AsyncIterator[PageImage]:
+        # every worker opens the document itself and extracts a chunk of pages; the chunks are yielded in page order
+        chunk_size = max(1, -(-page_count // (self.parallel_workers * 2)))
+        page_ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+        chunk_tasks = [
+            asyncio.ensure_future(self.executor.run(
+                extract_page_range, source, start, end, self.min_image_width, self.min_image_height,
+                self.budget.max_image_pixels, clock.remaining(), known_digests, self.get_render_options()
+            ))
+            for start, end in page_ranges
+        ]
+
+        # images repeated across chunks are only deduplicated here
+        seen_hashes = set()
+        clock.start()
+        try:
+            for chunk_task in chunk_tasks:
+                if not chunk_task.done():
+                    try:
+                        await asyncio.wait_for(asyncio.shield(chunk_task), clock.remaining())
+                    except asyncio.TimeoutError:
+                        stats.stop_reason = StopReason.TIME_BUDGET.value
+                        break
+                chunk_images, chunk_stats = chunk_task.result()
+                stats.merge(chunk_stats)
+                for page_image in chunk_images:
+                    if page_image.image_key in seen_hashes:
+                        stats.duplicates += 1
+                        continue
+                    seen_hashes.add(page_image.image_key)
+                    # the clock stops while the consumer handles the image
+                    clock.pause()
+                    yield page_image
+                    clock.start()
+        finally:
+            clock.pause()
+            for chunk_task in chunk_tasks:
+                chunk_task.cancel()
 
     def process_directory(self, source_directory_path, image_directory_path, processed_path=None) -> bool:
         # if at least one file from the directory has been processed, the directory will be considered processed
@@ -91,8 +466,199 @@ class PdfImageExtractor:
                 directory_processed = True
         return directory_processed
 
+    def get_render_options(self) -> Optional[RenderOptions]:
+        return self.render_options if self.mode == ExtractionMode.RENDER else None
+
     def gen_file_name(self, page_number, image_index) -> str:
         return gen_kebab_name()
 
+def is_passthrough_jpeg(base_image: dict) -> bool:
+    # CMYK and masked images still need PIL conversion to end up as a plain JPEG
+    return (
+        base_image.get("ext") in ('jpeg', 'jpg')
+        and base_image.get("colorspace") in (1, 3)
+        and not base_image.get("smask")
+    )
+
+
 def convert_rgba_to_rgb(image: Image) -> Image:
-    return image.convert('RGB')
\ No newline at end of file
+    return image.convert('RGB')
+
+
+def iter_page_images(pdf_document, page_numbers, min_image_width, min_image_height, stats: ExtractionStats, max_image_pixels=0, clock: ExtractionClock = None, known_digests: frozenset = frozenset(), render_options: RenderOptions = None) -> Iterator[PageImage]:
+    if render_options is not None:
+        return render_page_regions(
+            pdf_document, page_numbers, min_image_width, min_image_height, stats, max_image_pixels, clock, known_digests, render_options
+        )
+    return extract_page_images(
+        pdf_document, page_numbers, min_image_width, min_image_height, stats, max_image_pixels, clock, known_digests
+    )
+
+
+def extract_page_images(pdf_document, page_numbers, min_image_width, min_image_height, stats: ExtractionStats, max_image_pixels=0, clock: ExtractionClock = None, known_digests: frozenset = frozenset()) -> Iterator[PageImage]:
+    # templates repeat the same xref on every page, so each xref is extracted and hashed at most once;
+    # content duplicates stored under different xrefs are caught by the (smask, digest) index
+    seen_xrefs = set()
+    seen_hashes = set()
+
+    for page_number in page_numbers:
+        if clock is not None and clock.exceeded():
+            stats.stop_reason = StopReason.TIME_BUDGET.value
+            return
+
+        page = pdf_document.load_page(page_number)
+        images = page.get_images(full=True)
+        for img_index, img in enumerate(images):
+            stats.images_seen += 1
+            try:
+                # (xref, smask, width, height, ...) - undersized images are skipped before they are extracted and decoded
+                xref, smask, width, height = img[0], img[1], img[2], img[3]
+                if xref in seen_xrefs:
+                    stats.duplicate_xrefs += 1
+                    continue
+                seen_xrefs.add(xref)
+
+                if not (width > min_image_width and height > min_image_height):
+                    stats.skipped_by_size += 1
+                    continue
+
+                # giant embedded images are never decoded, they would blow up the worker's memory
+                if max_image_pixels and width * height > max_image_pixels:
+                    stats.skipped_by_pixels += 1
+                    continue
+
+                base_image = pdf_document.extract_image(xref)
+                image_bytes = base_image["image"]
+                image_hash = (smask, image_digest(image_bytes))
+
+                if image_hash[1] in known_digests:
+                    stats.known_duplicates += 1
+                    continue
+
+                if image_hash in seen_hashes:
+                    logging.warning(f"Duplicate image detected on page {page_number}, image {img_index}. Skipping...")
+                    stats.duplicates += 1
+                    continue
+
+                seen_hashes.add(image_hash)
+                if is_passthrough_jpeg(base_image):
+                    # embedded RGB/grayscale JPEGs are handed on unchanged, no decode and no generation loss
+                    yield PageImage(page_number, img_index, image_hash, image_bytes=image_bytes)
+                    continue
+
+                pil_image = Image.open(io.BytesIO(image_bytes))
+                if pil_image.mode not in ('RGB', 'L'):
+                    pil_image = convert_rgba_to_rgb(pil_image)
+
+                yield PageImage(page_number, img_index, image_hash, image=pil_image)
+            except Exception as e:
+                stats.errors += 1
+                traceback_str = traceback.format_exc()
+                logging.error(f"Exception while processing image {img_index} on page {page_number}: {traceback_str}")
+
+
+def get_photo_regions(page, tolerance=2.0) -> List[fitz.Rect]:
+    # image blocks that touch or overlap (tiles, masked layers) are merged into one photo region
+    regions = [fitz.Rect(info['bbox']) & page.rect for info in page.get_image_info()]
+    regions = [region for region in regions if not region.is_empty]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            grown = fitz.Rect(regions[i].x0 - tolerance, regions[i].y0 - tolerance, regions[i].x1 + tolerance, regions[i].y1 + tolerance)
+            for j in range(i + 1, len(regions)):
+                if grown.intersects(regions[j]):
+                    regions[i] = regions[i] | regions[j]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return regions
+
+
+def get_region_dpi(region: fitz.Rect, min_image_width, min_image_height, render_options: RenderOptions) -> Optional[int]:
+    # large regions are rendered at a lower DPI to bound the cost, but never below the minimum image size
+    max_side = max(region.width, region.height)
+    dpi = min(render_options.max_dpi, max(render_options.min_dpi, render_options.target_size * 72 / max_side))
+    required_dpi = max((min_image_width + 1) * 72 / region.width, (min_image_height + 1) * 72 / region.height)
+    if required_dpi > render_options.max_dpi:
+        return None
+    return int(round(max(dpi, required_dpi)))
+
+
+def render_page_regions(pdf_document, page_numbers, min_image_width, min_image_height, stats: ExtractionStats, max_image_pixels=0, clock: ExtractionClock = None, known_digests: frozenset = frozenset(), render_options: RenderOptions = None) -> Iterator[PageImage]:
+    seen_hashes = set()
+
+    for page_number in page_numbers:
+        if clock is not None and clock.exceeded():
+            stats.stop_reason = StopReason.TIME_BUDGET.value
+            return
+
+        page = pdf_document.load_page(page_number)
+        for region_index, region in enumerate(get_photo_regions(page)):
+            stats.images_seen += 1
+            try:
+                dpi = get_region_dpi(region, min_image_width, min_image_height, render_options)
+                if dpi is None:
+                    stats.skipped_by_size += 1
+                    continue
+
+                if max_image_pixels and (region.width * dpi / 72) * (region.height * dpi / 72) > max_image_pixels:
+                    stats.skipped_by_pixels += 1
+                    continue
+
+                pixmap = page.get_pixmap(dpi=dpi, clip=region, colorspace=fitz.csRGB, alpha=False)
+                image_hash = (0, image_digest(pixmap.samples))
+                if image_hash[1] in known_digests:
+                    stats.known_duplicates += 1
+                    continue
+
+                if image_hash in seen_hashes:
+                    stats.duplicates += 1
+                    continue
+
+                seen_hashes.add(image_hash)
+                image_bytes = pixmap.tobytes('jpg', jpg_quality=render_options.jpeg_quality)
+                yield PageImage(page_number, region_index, image_hash, image_bytes=image_bytes)
+            except Exception as e:
+                stats.errors += 1
+                traceback_str = traceback.format_exc()
+                logging.error(f"Exception while rendering region {region_index} on page {page_number}: {traceback_str}")
+
+
+def encode_page_image(page_image: PageImage) -> None:
+    # passed-through JPEGs already carry their original bytes
+    if page_image.image_bytes is None:
+        buffer = io.BytesIO()
+        page_image.image.save(buffer, format='JPEG')
+        page_image.image_bytes = buffer.getvalue()
+        page_image.image = None
+
+
+def extract_page_range(source: PdfSource, start_page, end_page, min_image_width, min_image_height, max_image_pixels=0, max_seconds: float = None, known_digests: frozenset = frozenset(), render_options: RenderOptions = None) -> Tuple[List[PageImage], ExtractionStats]:
+    # process pool worker: decodes (or renders) and JPEG-encodes the images of a page range, returns picklable results;
+    # max_seconds is the extraction time left when the chunk was dispatched
+    clock = ExtractionClock(max(max_seconds, 1e-3) if max_seconds is not None else 0)
+    clock.start()
+    stats = ExtractionStats()
+    page_images = []
+    with source.open() as pdf_document:
+        for page_image in iter_page_images(
+            pdf_document, range(start_page, end_page), min_image_width, min_image_height, stats, max_image_pixels, clock, known_digests, render_options
+        ):
+            try:
+                encode_page_image(page_image)
+                page_images.append(page_image)
+            except Exception as e:
+                stats.errors += 1
+                logging.error(f"Exception while encoding image {page_image.image_index} on page {page_image.page_number}: {e}")
+    return page_images, stats
+
+
+image_digest = get_digest_func(config.image_digest_algorithm)
+
+pdf_extraction_executor = CpuExecutor(kind='process', max_workers=config.pdf_extraction_workers)
+
+pdf_producer_executor = CpuExecutor(kind='thread', max_workers=config.pdf_producer_threads, thread_name_prefix='pdf-producer')
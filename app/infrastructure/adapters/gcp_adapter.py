@@ -1,14 +1,46 @@
+import asyncio
+import io
+import mimetypes
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import quote
+
+from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+from app.core.config import config
 
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "/app/sa-key.json"
 
+# blocking google-cloud-storage calls run here, the pool bounds how many transfers run at once
+gcs_executor = ThreadPoolExecutor(max_workers=config.gcs_max_workers, thread_name_prefix='gcs')
+
+
+def create_storage_client() -> storage.Client:
+    if config.gcs_emulator_host:
+        # fake-gcs-server: the client picks up STORAGE_EMULATOR_HOST and needs no real credentials
+        client = storage.Client(project=config.gcs_emulator_project, credentials=AnonymousCredentials())
+    else:
+        client = storage.Client()
+
+    # the default HTTP pool keeps 10 connections, one per worker avoids reconnecting under load
+    http_adapter = HTTPAdapter(pool_connections=config.gcs_max_workers, pool_maxsize=config.gcs_max_workers)
+    client._http.mount('https://', http_adapter)
+    client._http.mount('http://', http_adapter)
+    return client
+
 
 class GCPAdapter:
     def __init__(self):
-        self.client = storage.Client()
+        self.client = create_storage_client()
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(gcs_executor, func, *args)
 
     async def download_file(self, cloud_bucket, destination_path):
         try:
@@ -21,26 +53,85 @@ class GCPAdapter:
 
             local_file_path = os.path.join(destination_path, file_name)
 
-            blob.download_to_filename(local_file_path)
+            await self.run(blob.download_to_filename, local_file_path)
             logging.info(f"Downloaded {file_name} to {local_file_path}")
             return local_file_path
         except Exception as e:
             logging.error(f"Failed to download file from GCS: {e}")
             return None
 
-    async def upload_file(self, bucket_name, local_filepath, cloud_filepath=None):
+    async def get_file_size(self, cloud_bucket):
         try:
-            bucket = self.client.bucket(bucket_name)
-            if not cloud_filepath:
-                cloud_filepath = os.path.basename(local_filepath)
+            bucket = self.client.bucket(cloud_bucket['bucket_name'])
+            blob = await self.run(bucket.get_blob, cloud_bucket['bucket_path'])
+            return blob.size if blob else None
+        except Exception as e:
+            logging.error(f"Failed to get file size from GCS: {e}")
+            return None
+
+    async def download_bytes(self, cloud_bucket):
+        try:
+            bucket = self.client.bucket(cloud_bucket['bucket_name'])
+            blob = bucket.blob(cloud_bucket['bucket_path'])
+            data = await self.run(blob.download_as_bytes)
+            logging.info(f"Downloaded {cloud_bucket['file_name']} into memory ({len(data)} bytes)")
+            return data
+        except Exception as e:
+            logging.error(f"Failed to download file from GCS: {e}")
+            return None
 
+    async def download_to_file(self, cloud_bucket, file_obj):
+        try:
+            bucket = self.client.bucket(cloud_bucket['bucket_name'])
+            blob = bucket.blob(cloud_bucket['bucket_path'])
+            await self.run(blob.download_to_file, file_obj)
+            logging.info(f"Downloaded {cloud_bucket['file_name']} to {file_obj.name}")
+            return file_obj.name
+        except Exception as e:
+            logging.error(f"Failed to download file from GCS: {e}")
+            return None
+
+    async def upload_file(self, bucket_name, local_filepath, cloud_filepath=None, content_type=None, cache_control=None):
+        if not cloud_filepath:
+            cloud_filepath = os.path.basename(local_filepath)
+
+        with open(local_filepath, 'rb') as data:
+            return await self.upload_stream(
+                bucket_name, data, cloud_filepath, content_type, cache_control, size=os.path.getsize(local_filepath)
+            )
+
+    async def upload_bytes(self, bucket_name, data: bytes, cloud_filepath, content_type=None, cache_control=None):
+        return await self.upload_stream(
+            bucket_name, io.BytesIO(data), cloud_filepath, content_type, cache_control, size=len(data)
+        )
+
+    async def upload_stream(self, bucket_name, stream, cloud_filepath, content_type=None, cache_control=None, size=None):
+        # small bodies go in a single request, large or unknown-size ones as a chunked resumable upload
+        try:
+            bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(cloud_filepath)
-            blob.upload_from_filename(local_filepath)
+            if size is None or size > config.upload_multipart_threshold_mb * 1024 * 1024:
+                blob.chunk_size = config.upload_part_size_mb * 1024 * 1024
+            if cache_control:
+                blob.cache_control = cache_control
+            content_type = content_type or mimetypes.guess_type(cloud_filepath)[0] or 'application/octet-stream'
+
+            await self.run(partial(blob.upload_from_file, stream, size=size, content_type=content_type))
             logging.info(f"Uploaded file to GCS: {bucket_name}/{cloud_filepath}")
             return self.get_url(bucket_name, cloud_filepath)
         except Exception as e:
             logging.error(f"Failed to upload file to GCS: {e}")
 
+    async def exists(self, bucket_name, cloud_filepath) -> bool:
+        try:
+            blob = self.client.bucket(bucket_name).blob(cloud_filepath)
+            return await self.run(blob.exists)
+        except Exception as e:
+            logging.error(f"Failed to check file in GCS: {e}")
+            return False
+
     def get_url(self, bucket_name, cloud_filepath):
         logging.info(f"Getting URL for file in GCS: {bucket_name}/{cloud_filepath}")
+        if config.gcs_emulator_host:
+            return f"{config.gcs_emulator_host}/storage/v1/b/{bucket_name}/o/{quote(cloud_filepath, safe='')}?alt=media"
         return f"https://storage.googleapis.com/{bucket_name}/{cloud_filepath}"
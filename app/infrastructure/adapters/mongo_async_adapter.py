@@ -26,6 +26,16 @@ class MongoAsyncAdapter:
         cursor = self.collection.find(query)
         return [doc async for doc in cursor]
 
+    async def find_documents(self, query, projection=None, sort=None, limit=0):
+        cursor = self.collection.find(query, projection, sort=sort, limit=limit)
+        return [doc async for doc in cursor]
+
+    async def count_documents(self, query):
+        return await self.collection.count_documents(query)
+
+    async def bulk_write(self, operations, **kwargs):
+        return await self.collection.bulk_write(operations, **kwargs)
+
     async def document_exist(self, query):
         return await self.collection.count_documents(query, limit=1)
 
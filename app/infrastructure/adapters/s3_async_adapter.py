@@ -1,46 +1,93 @@
+import asyncio
+import io
 import logging
+import mimetypes
+import os
+import time
 import traceback
+from contextlib import AsyncExitStack
 
+from aiobotocore.config import AioConfig
 from aiobotocore.session import get_session
-from botocore.exceptions import NoCredentialsError
+from botocore.exceptions import ClientError, NoCredentialsError
 from app.core.config import config
+from app.core.metrics import metrics
+
+# S3 rejects multipart uploads whose parts, all but the last, are smaller than this
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
 
 
 class S3AsyncAdapter:
+    # one long-lived client per process: its connection pool is shared by all uploads and downloads
     def __init__(self):
         self.client = None
+        self.exit_stack = None
+        self.lock = asyncio.Lock()
 
     async def connect(self):
-        if not self.client:
-            session = get_session()
-            self.client = session.create_client(
-                's3',
-                aws_access_key_id=config.s3_access_key,
-                aws_secret_access_key=config.s3_secret_key
-            )
+        async with self.lock:
+            if self.client is None:
+                session = get_session()
+                exit_stack = AsyncExitStack()
+                self.client = await exit_stack.enter_async_context(session.create_client(
+                    's3',
+                    region_name=config.s3_region,
+                    aws_access_key_id=config.s3_access_key,
+                    aws_secret_access_key=config.s3_secret_key,
+                    config=AioConfig(max_pool_connections=config.s3_max_pool_connections)
+                ))
+                self.exit_stack = exit_stack
+                metrics.increment('s3_client_opened')
+                logging.info(f"S3 client opened, pool size {config.s3_max_pool_connections}")
+        return self.client
 
-    async def create_client(self):
-        session = get_session()
-        return session.create_client(
-            's3',
-            aws_access_key_id=config.s3_access_key,
-            aws_secret_access_key=config.s3_secret_key
-        )
+    async def get_client(self):
+        if self.client is None:
+            return await self.connect()
+        # counts calls served by the shared client object; whether aiohttp reused a pooled connection is not visible here
+        metrics.increment('s3_shared_client_calls')
+        return self.client
 
     async def close(self):
-        if self.client:
-            await self.client.close()
+        async with self.lock:
+            if self.exit_stack is not None:
+                await self.exit_stack.aclose()
+                self.client = None
+                self.exit_stack = None
+                logging.info("S3 client closed")
 
-    async def upload_file(self, bucket_name, local_filepath, cloud_filepath=None):
+    async def timed(self, operation, coro):
+        start_time = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            metrics.observe(f's3_{operation}_ms', (time.perf_counter() - start_time) * 1000)
+
+    async def upload_file(self, bucket_name, local_filepath, cloud_filepath=None, content_type=None, cache_control=None):
         if not cloud_filepath:
             cloud_filepath = local_filepath.split('/')[-1]
 
+        with open(local_filepath, 'rb') as data:
+            return await self.upload_stream(bucket_name, data, cloud_filepath, content_type, cache_control)
+
+    async def upload_bytes(self, bucket_name, data: bytes, cloud_filepath, content_type=None, cache_control=None):
+        return await self.upload_stream(bucket_name, io.BytesIO(data), cloud_filepath, content_type, cache_control)
+
+    async def upload_stream(self, bucket_name, stream, cloud_filepath, content_type=None, cache_control=None):
+        # a body that fits in one part is sent with put_object, a larger one as a multipart upload
         logging.info(f"Uploading file to S3: {bucket_name}/{cloud_filepath}")
         try:
-            async with await self.create_client() as s3_client:
-                # await s3_client.upload_file(local_filepath, bucket_name, cloud_filepath)
-                with open(local_filepath, 'rb') as data:
-                    await s3_client.put_object(Bucket=bucket_name, Key=cloud_filepath, Body=data)
+            s3_client = await self.get_client()
+            params = self.get_upload_params(cloud_filepath, content_type, cache_control)
+            threshold = config.upload_multipart_threshold_mb * 1024 * 1024
+            head_size = max(threshold, self.get_part_size())
+            head = stream.read(head_size)
+            if len(head) < head_size and len(head) <= threshold:
+                await self.timed('put_object', s3_client.put_object(
+                    Bucket=bucket_name, Key=cloud_filepath, Body=head, **params
+                ))
+            else:
+                await self.upload_multipart(s3_client, bucket_name, cloud_filepath, stream, head, params)
             return self.get_url(bucket_name, cloud_filepath)
         except NoCredentialsError:
             return "AWS credentials not found. Ensure you have set up your AWS credentials properly."
@@ -48,18 +95,149 @@ class S3AsyncAdapter:
             traceback_str = traceback.format_exc()
             logging.error(f"Error: {traceback_str}")
 
+    async def upload_multipart(self, s3_client, bucket_name, cloud_filepath, stream, head: bytes, params: dict):
+        # parts are cut from the already read head, then read from the stream one at a time,
+        # at most s3_upload_concurrency of them are in flight
+        upload = await s3_client.create_multipart_upload(Bucket=bucket_name, Key=cloud_filepath, **params)
+        upload_id = upload['UploadId']
+        semaphore = asyncio.Semaphore(config.s3_upload_concurrency)
+        part_size = self.get_part_size()
+
+        def read_part() -> bytes:
+            nonlocal head
+            if len(head) < part_size:
+                head += stream.read(part_size - len(head))
+            body, head = head[:part_size], head[part_size:]
+            return body
+
+        async def upload_part(part_number, body):
+            try:
+                response = await self.timed('upload_part', s3_client.upload_part(
+                    Bucket=bucket_name, Key=cloud_filepath, UploadId=upload_id, PartNumber=part_number, Body=body
+                ))
+                return {'ETag': response['ETag'], 'PartNumber': part_number}
+            finally:
+                semaphore.release()
+
+        tasks = []
+        try:
+            body = read_part()
+            while body:
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(upload_part(len(tasks) + 1, body)))
+                body = read_part()
+            parts = await asyncio.gather(*tasks)
+            await s3_client.complete_multipart_upload(
+                Bucket=bucket_name, Key=cloud_filepath, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await s3_client.abort_multipart_upload(Bucket=bucket_name, Key=cloud_filepath, UploadId=upload_id)
+            raise
+
+    def get_part_size(self) -> int:
+        return max(config.upload_part_size_mb * 1024 * 1024, S3_MIN_PART_SIZE)
+
+    def get_upload_params(self, cloud_filepath, content_type=None, cache_control=None) -> dict:
+        params = {'ContentType': content_type or mimetypes.guess_type(cloud_filepath)[0] or 'application/octet-stream'}
+        if cache_control:
+            params['CacheControl'] = cache_control
+        return params
+
     async def download_file(self, bucket_name, cloud_filepath, local_filepath):
+        # the body is written chunk by chunk, large objects are fetched as parallel ranged GETs into their offsets
         logging.info(f"Downloading file from S3: {bucket_name}/{cloud_filepath} to {local_filepath}")
         try:
-            await self.connect()
-            async with self.client as s3_client:
-                response = await s3_client.get_object(Bucket=bucket_name, Key=cloud_filepath)
-                async with response['Body'] as stream:
-                    with open(local_filepath, 'wb') as f:
-                        chunk = await stream.read()
-                        f.write(chunk)
+            size = await self.get_object_size(bucket_name, cloud_filepath)
+            try:
+                with open(local_filepath, 'wb') as f:
+                    if size >= config.s3_ranged_download_threshold_mb * 1024 * 1024:
+                        f.truncate(size)
+                        fd = f.fileno()
+                        await self.download_ranges(
+                            bucket_name, cloud_filepath, size, lambda offset, chunk: os.pwrite(fd, chunk, offset)
+                        )
+                    else:
+                        await self.download_stream(bucket_name, cloud_filepath, lambda offset, chunk: f.write(chunk))
+            except BaseException:
+                # a failed download leaves no partial file behind
+                if os.path.exists(local_filepath):
+                    os.remove(local_filepath)
+                raise
+            return local_filepath
         except Exception as e:
             logging.error(f"Error: {e}")
 
+    async def download_bytes(self, bucket_name, cloud_filepath):
+        # the object body is read in chunks straight into memory, nothing is written to disk
+        logging.info(f"Downloading file from S3 into memory: {bucket_name}/{cloud_filepath}")
+        try:
+            size = await self.get_object_size(bucket_name, cloud_filepath)
+            buffer = bytearray(size)
+
+            def write(offset, chunk):
+                buffer[offset:offset + len(chunk)] = chunk
+
+            if size >= config.s3_ranged_download_threshold_mb * 1024 * 1024:
+                await self.download_ranges(bucket_name, cloud_filepath, size, write)
+            else:
+                await self.download_stream(bucket_name, cloud_filepath, write)
+            return bytes(buffer)
+        except Exception as e:
+            logging.error(f"Error: {e}")
+            return None
+
+    async def get_object_size(self, bucket_name, cloud_filepath) -> int:
+        s3_client = await self.get_client()
+        response = await self.timed('head_object', s3_client.head_object(Bucket=bucket_name, Key=cloud_filepath))
+        return response['ContentLength']
+
+    async def download_stream(self, bucket_name, cloud_filepath, write, byte_range=None, offset=0) -> None:
+        # write(offset, chunk) is called for every chunk as it arrives
+        s3_client = await self.get_client()
+
+        async def read():
+            params = {'Range': f'bytes={byte_range[0]}-{byte_range[1]}'} if byte_range else {}
+            response = await s3_client.get_object(Bucket=bucket_name, Key=cloud_filepath, **params)
+            position = offset
+            async with response['Body'] as stream:
+                async for chunk in stream.iter_chunks(config.s3_download_chunk_size_kb * 1024):
+                    write(position, chunk)
+                    position += len(chunk)
+
+        await self.timed('get_object_range' if byte_range else 'get_object', read())
+
+    async def download_ranges(self, bucket_name, cloud_filepath, size, write) -> None:
+        part_size = config.s3_download_part_size_mb * 1024 * 1024
+        semaphore = asyncio.Semaphore(config.s3_download_concurrency)
+
+        async def download_part(start):
+            end = min(start + part_size, size) - 1
+            async with semaphore:
+                await self.download_stream(bucket_name, cloud_filepath, write, byte_range=(start, end), offset=start)
+
+        # when a part fails the task group cancels and awaits the others, so none writes after the caller gave up
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                for start in range(0, size, part_size):
+                    task_group.create_task(download_part(start))
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+
+    async def exists(self, bucket_name, cloud_filepath) -> bool:
+        try:
+            s3_client = await self.get_client()
+            await self.timed('head_object', s3_client.head_object(Bucket=bucket_name, Key=cloud_filepath))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            logging.error(f"Error: {e}")
+            return False
+
     def get_url(self, bucket_name, cloud_filepath):
         return f"https://{bucket_name}.s3.amazonaws.com/{cloud_filepath}"
+
+
+s3_async_adapter = S3AsyncAdapter()
@@ -9,12 +9,24 @@ from app.middlewares.auth_middleware import check_api_key
 from app.api.v1.routes import routers as v1_routers
 from app.api.routes import router as routers
 from app.core.config import Config
+from app.core.cpu_executor import cpu_executor
+from app.core.metrics import EventLoopLagMonitor
+from app.core.my.classifiers.inference_scheduler import inference_scheduler
+from app.core.my.classifiers.model_registry import model_registry
+from app.core.my.classifiers.verdict_cache import verdict_cache
+from app.core.my.extractors.pdf_image_extractor import pdf_extraction_executor, pdf_producer_executor
+from app.infrastructure.adapters.gcp_adapter import gcs_executor
+from app.infrastructure.adapters.s3_async_adapter import s3_async_adapter
 from app.services.queue_service import QueueService
 
 
 class AppFactory():
     def __init__(self, config: Config) -> None:
         self.config = config
+        self.loop_lag_monitor = EventLoopLagMonitor(
+            self.config.event_loop_lag_interval_ms,
+            warning_ms=self.config.event_loop_lag_warning_ms
+        )
 
         logging.basicConfig(level=logging.INFO)
 
@@ -39,6 +51,7 @@ class AppFactory():
         self.app.include_router(routers)
         self.app.include_router(v1_routers, prefix=self.config.api_v1_url)
         self.app.add_event_handler("startup", self.on_startup)
+        self.app.add_event_handler("shutdown", self.on_shutdown)
 
     async def on_startup(self):
         # # 20240705, Dima: commented with implementing queueless
@@ -48,6 +61,23 @@ class AppFactory():
         os.makedirs(self.config.pdf_images_path, exist_ok=True)
         os.makedirs(self.config.classifier_path, exist_ok=True)
 
+        # loads the shared classifier once per process, off the event loop
+        await asyncio.to_thread(model_registry.get_real_estate_classifier)
+        inference_scheduler.start()
+        self.loop_lag_monitor.start()
+        if self.config.s3_access_key:
+            await s3_async_adapter.connect()
+
+    async def on_shutdown(self):
+        await self.loop_lag_monitor.stop()
+        await asyncio.to_thread(inference_scheduler.stop, 10)
+        await verdict_cache.flush()
+        await s3_async_adapter.close()
+        await asyncio.to_thread(cpu_executor.shutdown)
+        await asyncio.to_thread(pdf_extraction_executor.shutdown)
+        await asyncio.to_thread(pdf_producer_executor.shutdown)
+        await asyncio.to_thread(gcs_executor.shutdown)
+
     def get_app(self) -> FastAPI:
         return self.app
 
@@ -1,4 +1,6 @@
-from typing import List, Optional
+from typing import Iterable, List, Optional, Set
+
+from app.core.config import config
 from app.infrastructure.adapters.mongo_async_adapter import MongoAsyncAdapter
 
 
@@ -23,6 +25,29 @@ class ImageRepository:
 
         return doc["image_urls"]
 
+    async def get_image_digests(self, property_id, model_version: str) -> Set[bytes]:
+        # digests are stored as '<algorithm>:<model version>:<hex>'; the ones of another algorithm are useless for
+        # dedup, and an image another model judged may get a different verdict now
+        async with self.adapter as adapter:
+            doc = await adapter.find_document({
+                "property_id": property_id
+            })
+
+        prefix = f'{config.image_digest_algorithm}:{model_version}:'
+        digests = doc.get("image_digests", []) if doc else []
+        return {bytes.fromhex(digest[len(prefix):]) for digest in digests if digest.startswith(prefix)}
+
+    async def add_image_digests(self, property_id, model_version: str, digests: Iterable[bytes]) -> None:
+        values = [f'{config.image_digest_algorithm}:{model_version}:{digest.hex()}' for digest in digests]
+        if not values:
+            return
+        async with self.adapter as adapter:
+            await adapter.update_one(
+                {"property_id": property_id},
+                {'$addToSet': {'image_digests': {'$each': values}}},
+                upsert=True
+            )
+
     async def add_images(self, property_id, links) -> None:
         async with self.adapter as adapter:
             await adapter.update_one(
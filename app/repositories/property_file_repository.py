@@ -1,12 +1,35 @@
 import os
+import tempfile
+from collections import OrderedDict
 
 from app.core.config import config
+from app.core.metrics import metrics
+from app.core.my.extractors.pdf_image_extractor import CONTENT_NAME_SEPARATOR, PdfSource
 from app.infrastructure.adapters.s3_async_adapter import S3AsyncAdapter
 from app.infrastructure.adapters.gcp_adapter import GCPAdapter
 from app.schemas.pdf_schema import PdfSchema
 from app.schemas.property_schema import PropertySchema
 
 
+class KnownKeyCache:
+    # LRU of object keys known to exist in the bucket, so repeated content-addressed uploads skip the HEAD request
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.keys = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.keys:
+            self.keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: str) -> None:
+        self.keys[key] = None
+        self.keys.move_to_end(key)
+        while len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
+
+
 class PropertyFileRepository:
     def __init__(self):
         self.adapter = GCPAdapter()
@@ -24,17 +47,74 @@ class PropertyFileRepository:
         )
         return local_file_path
 
+    async def load_pdf(self, pdf: PdfSchema, spill_path: str) -> PdfSource:
+        # small PDFs stay in memory; unknown or large ones go to a temporary file the caller closes after extraction
+        file_name = pdf.cloud_bucket['file_name']
+        file_size = await self.adapter.get_file_size(pdf.cloud_bucket)
+        if file_size is not None and file_size <= config.pdf_memory_threshold_mb * 1024 * 1024:
+            data = await self.adapter.download_bytes(pdf.cloud_bucket)
+            if data is not None:
+                return PdfSource(file_name, data=data)
+
+        with tempfile.NamedTemporaryFile(dir=spill_path, suffix='.pdf', delete=False) as file_obj:
+            temp_path = file_obj.name
+            downloaded = await self.adapter.download_to_file(pdf.cloud_bucket, file_obj)
+        source = PdfSource(file_name, path=temp_path, temporary=True)
+        if downloaded is None:
+            source.close()
+            return None
+        return source
+
     async def upload_image(self, local_path: str, property_id: str) -> str:
         # file_name = local_path.split('/')[-1]
         # cloud_path = os.path.join(property_id, file_name)
         cloud_path = self.prep_path(
             local_path, property_id
         )
+        if await self.image_exists(cloud_path):
+            return self.adapter.get_url(config.s3_image_bucket, cloud_path)
+
         url = await self.adapter.upload_file(
-            config.s3_image_bucket, local_path, cloud_path
+            config.s3_image_bucket, local_path, cloud_path,
+            content_type='image/jpeg', cache_control=config.image_cache_control
         )
+        self.remember_image(cloud_path, url)
         return url
 
+    async def upload_image_bytes(self, data: bytes, file_name: str, property_id: str) -> str:
+        cloud_path = self.prep_path(
+            file_name, property_id
+        )
+        if await self.image_exists(cloud_path):
+            return self.adapter.get_url(config.s3_image_bucket, cloud_path)
+
+        url = await self.adapter.upload_bytes(
+            config.s3_image_bucket, data, cloud_path,
+            content_type='image/jpeg', cache_control=config.image_cache_control
+        )
+        self.remember_image(cloud_path, url)
+        return url
+
+    async def image_exists(self, cloud_path: str) -> bool:
+        # only content-addressed keys can be trusted to hold the same bytes
+        if config.image_key_scheme != 'content':
+            return False
+
+        exists = cloud_path in known_image_keys
+        if not exists and config.image_exists_check == 'head':
+            exists = await self.adapter.exists(config.s3_image_bucket, cloud_path)
+            if exists:
+                known_image_keys.add(cloud_path)
+
+        if exists:
+            metrics.increment('image_upload_skipped')
+        return exists
+
+    def remember_image(self, cloud_path: str, url) -> None:
+        # adapters return None when the upload failed
+        if url and config.image_key_scheme == 'content':
+            known_image_keys.add(cloud_path)
+
     def get_image_url(self, local_path: str, property_id: str) -> str:
         cloud_path = self.prep_path(
             local_path, property_id
@@ -45,7 +125,17 @@ class PropertyFileRepository:
 
     def prep_path(self, file_path: str, folder: str) -> str:
         file_name = file_path.split('/')[-1]
+        if config.image_key_scheme == 'content':
+            # '<digest>_<unique name>.jpg' is stored as '<digest>.jpg'
+            stem, ext = os.path.splitext(file_name)
+            file_name = stem.split(CONTENT_NAME_SEPARATOR)[0] + ext
+            # global content-addressed keys are shared by all properties
+            if config.image_key_scope == 'global':
+                folder = config.image_key_prefix
         return os.path.join(
             folder, file_name
         )
 
+
+known_image_keys = KnownKeyCache(config.known_image_keys_max_size)
+
@@ -1,6 +1,7 @@
-from typing import List
-from pydantic import BaseModel
+from typing import List, Union
+from pydantic import BaseModel, ConfigDict
 
+from app.core.my.extractors.pdf_image_extractor import ExtractedImage
 from app.schemas.pdf_schema import PdfSchema
 
 
@@ -14,9 +15,12 @@ class PropertySchema(BaseModel):
 
 class PropertyImagesSchema(BaseModel):
     property_data: PropertySchema
-    images: List[str]
+    # extracted images are kept in memory when the in-memory pipeline is enabled
+    images: List[Union[str, ExtractedImage]]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
 
     @classmethod
-    def from_params(cls, property_data: PropertySchema, images: list[str]) -> 'PropertyImagesSchema':
+    def from_params(cls, property_data: PropertySchema, images: list[Union[str, ExtractedImage]]) -> 'PropertyImagesSchema':
         return cls(property_data=property_data, images=images)
 
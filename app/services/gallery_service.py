@@ -1,51 +1,164 @@
 import logging
 import os
 import aiofiles
-from typing import List
+from typing import AsyncIterator, List, Optional, Tuple, Union
+
+import numpy as np
 
 from app.core.config import config
-from app.core.my.classifiers.real_estate_image_classifier import RealEstateImageClassifier
-from app.core.my.extractors.pdf_image_extractor import PdfImageExtractor
+from app.core.cpu_executor import cpu_executor
+from app.core.my.classifiers.inference_scheduler import inference_scheduler
+from app.core.my.classifiers.model_registry import model_registry
+from app.core.my.classifiers.prefilter import image_prefilter, prefilter_images
+from app.core.my.classifiers.real_estate_image_classifier import RealEstateImageClassifier, preprocess_hashed_batch
+from app.core.my.classifiers.verdict_cache import verdict_cache
+from app.core.my.extractors.pdf_image_extractor import ExtractedImage, ImageDedupIndex, PdfImageExtractor, PdfSource
 
 
 class GalleryService:
-    async def get_images_from_pdf(self, pdf_file_path: str) -> List[str]:
-        pdf_file_name = os.path.basename(pdf_file_path)
+    async def get_images_from_pdf(self, pdf_file_path: Union[str, PdfSource], in_memory=False) -> List[Union[str, ExtractedImage]]:
+        return [image async for image in self.iter_images_from_pdf(pdf_file_path, in_memory=in_memory)]
+
+    async def iter_images_from_pdf(self, pdf_file_path: Union[str, PdfSource], in_memory=False, dedup_index: ImageDedupIndex = None) -> AsyncIterator[Union[str, ExtractedImage]]:
+        pdf_images_directory_path = self.get_pdf_images_path(pdf_file_path)
+
+        extractor = PdfImageExtractor()
+        async for image in extractor.iter_images(pdf_file_path, pdf_images_directory_path, in_memory=in_memory, dedup_index=dedup_index):
+            yield image
+
+    def get_pdf_images_path(self, pdf_file_path: Union[str, PdfSource]) -> str:
+        pdf_file_name = pdf_file_path.name if isinstance(pdf_file_path, PdfSource) else os.path.basename(pdf_file_path)
         pdf_folder_name = ".".join(pdf_file_name.split('.')[:-1])
 
         pdf_images_directory_path = os.path.join(config.pdf_images_path, pdf_folder_name)
         os.makedirs(pdf_images_directory_path, exist_ok=True)
+        return pdf_images_directory_path
 
-        extractor = PdfImageExtractor()
-        image_list = await extractor.process_file(
-            pdf_file_path, pdf_images_directory_path
-        )
-
-        return image_list
+    async def classify_images(self, images: List[Union[str, ExtractedImage]]) -> List[Union[str, ExtractedImage]]:
+        valid_images, _ = await self.classify_scored_images(images)
+        return valid_images
 
-    async def classify_images(self, image_paths: List[str]) -> list[str]:
+    async def classify_scored_images(self, images: List[Union[str, ExtractedImage]]) -> Tuple[List[Union[str, ExtractedImage]], List[Optional[float]]]:
+        # returns the valid images and the score of every image, None where it couldn't be classified.
+        # in-memory images are classified without touching the disk, only valid ones are written for upload
+        # (or returned as they are when they're uploaded straight from memory)
         logging.info("Image Classification...")
         valid_images = []
 
         # supervised dataset folders
         real_estate_images, invalid_images = self.get_classifier_path()
 
-        classifier = RealEstateImageClassifier()
-        for file_path in image_paths:
-            real_estate_image = classifier.is_real_estate_image(
-                file_path
-            )
+        # decoding and preprocessing run in the CPU executor, inference in the shared scheduler batches
+        classifier = model_registry.get_real_estate_classifier()
+        image_sources = [image.get_source() if isinstance(image, ExtractedImage) else image for image in images]
+        scores = await self.predict_filtered_scores(image_sources, classifier)
+
+        for image, score in zip(images, scores):
+            real_estate_image = classifier.is_real_estate_score(score)
+            destination_file_path = real_estate_images if real_estate_image else invalid_images
+
+            if isinstance(image, ExtractedImage):
+                file_path = await self.save_extracted_image(
+                    image, real_estate_image, destination_file_path
+                )
+                if real_estate_image and config.upload_from_memory:
+                    file_path = image
+            else:
+                file_path = image
+                # copies image to classifier directory to use in further training
+                if config.classifier_dataset_collection:
+                    await self.copy_file(file_path, destination_file_path)
 
             if real_estate_image:
                 valid_images.append(file_path)
-                destination_file_path = real_estate_images
-            else:
-                destination_file_path = invalid_images
 
-            # copies image to classifier directory to use in further training
-            await self.copy_file(file_path, destination_file_path)
+        return valid_images, scores
 
-        return valid_images
+    async def save_extracted_image(self, image: ExtractedImage, real_estate_image: bool, dataset_path: str) -> str:
+        # encodes the image once and writes it where it's needed: the upload path and/or the training dataset
+        if not config.classifier_dataset_collection and (not real_estate_image or config.upload_from_memory):
+            return image.path
+
+        image_bytes = await cpu_executor.run(image.to_bytes)
+        # kept, so an upload from memory doesn't encode the image again
+        image.image_bytes = image_bytes
+
+        if real_estate_image and not config.upload_from_memory:
+            await self.write_file(image.path, image_bytes)
+
+        if config.classifier_dataset_collection:
+            await self.write_file(
+                os.path.join(dataset_path, os.path.basename(image.path)), image_bytes
+            )
+
+        return image.path
+
+    async def write_file(self, path: str, data: bytes) -> None:
+        async with aiofiles.open(path, 'wb') as file:
+            await file.write(data)
+
+    async def predict_filtered_scores(self, image_sources: list, classifier: RealEstateImageClassifier) -> List[Optional[float]]:
+        # obvious negatives are rejected by the prefilter cascade, only ambiguous images are preprocessed for the CNN
+        if config.prefilter_enabled:
+            rejections = await cpu_executor.run(prefilter_images, image_sources, image_prefilter)
+            image_prefilter.record(rejections)
+        else:
+            rejections = [None] * len(image_sources)
+
+        scores = [None] * len(image_sources)
+        indexes = [index for index, rejection in enumerate(rejections) if rejection is None]
+        if not indexes:
+            return scores
+
+        batch, processed, image_hashes = await cpu_executor.run(
+            preprocess_hashed_batch, [image_sources[index] for index in indexes], classifier.img_height, classifier.img_width
+        )
+        predicted_scores = await self.predict_cached_scores(batch, processed, image_hashes)
+        for index, score in zip(indexes, predicted_scores):
+            scores[index] = score
+        return scores
+
+    async def predict_cached_scores(self, batch: np.ndarray, processed: List[bool], image_hashes: List[Optional[str]]) -> List[Optional[float]]:
+        # images already classified by the current model (same perceptual hash) skip the CNN
+        if not config.verdict_cache_enabled:
+            return await self.predict_scores(batch, processed)
+
+        classifier = model_registry.get_real_estate_classifier()
+        model_version = classifier.get_model_version()
+        cached_verdicts = await verdict_cache.get_many(model_version, image_hashes)
+
+        misses = [ok and cached is None for ok, cached in zip(processed, cached_verdicts)]
+        scores = await self.predict_scores(batch, misses)
+
+        # a verdict is only stored when every image of the batch with that hash got the same verdict
+        new_verdicts = {}
+        conflicting_hashes = set()
+        for index, cached in enumerate(cached_verdicts):
+            if cached is not None:
+                scores[index] = cached['score']
+            elif misses[index] and scores[index] is not None and image_hashes[index] is not None:
+                image_hash = image_hashes[index]
+                verdict = classifier.score_to_class(scores[index]).value
+                if image_hash in new_verdicts and new_verdicts[image_hash]['verdict'] != verdict:
+                    conflicting_hashes.add(image_hash)
+                new_verdicts[image_hash] = {'score': scores[index], 'verdict': verdict}
+
+        for image_hash in conflicting_hashes:
+            del new_verdicts[image_hash]
+
+        if new_verdicts:
+            await verdict_cache.set_many(model_version, new_verdicts)
+        return scores
+
+    async def predict_scores(self, batch: np.ndarray, processed: List[bool]) -> List[Optional[float]]:
+        scores = [None] * len(processed)
+        indexes = [index for index, ok in enumerate(processed) if ok]
+        predicted_scores = await inference_scheduler.predict(
+            [batch[index] for index in indexes]
+        )
+        for index, score in zip(indexes, predicted_scores):
+            scores[index] = score
+        return scores
 
     async def copy_file(self, src: str, dest: str) -> None:
         file_name = os.path.basename(src)
@@ -1,9 +1,13 @@
 import asyncio
 import logging
 import os
-from typing import List
+from typing import AsyncIterator, List, Optional, Union
 
+from app.core.config import config
+from app.core.cpu_executor import cpu_executor
+from app.core.my.extractors.pdf_image_extractor import ExtractedImage, ImageDedupIndex
 from app.repositories.property_file_repository import PropertyFileRepository
+from app.schemas.pdf_schema import PdfSchema
 from app.schemas.property_schema import PropertySchema, PropertyImagesSchema
 from app.services.gallery_service import GalleryService
 from app.utils.helpers import chunk_list
@@ -14,16 +18,8 @@ class PropertyImageService:
         self.file_repository = PropertyFileRepository()
         self.gallery_service = GalleryService()
 
-    async def extract_images(self, property_data: PropertySchema, bundle_size=None) -> List[List[str]]:
-        download_path = self.file_repository.get_local_dir(property_data)
-        extracted_image_paths = []
-
-        for pdf in property_data.pdfs:
-            pdf_file_path = await self.file_repository.download_pdf(pdf, download_path)
-            image_paths = await self.gallery_service.get_images_from_pdf(
-                pdf_file_path
-            )
-            extracted_image_paths.extend(image_paths)
+    async def extract_images(self, property_data: PropertySchema, bundle_size=None) -> List[List[Union[str, ExtractedImage]]]:
+        extracted_image_paths = [image async for image in self.iter_images(property_data)]
 
         if bundle_size:
             bundled_image_paths = chunk_list(extracted_image_paths, bundle_size)
@@ -32,33 +28,145 @@ class PropertyImageService:
 
         return bundled_image_paths
 
-    async def process_images(self, property_images: PropertyImagesSchema):
+    async def iter_image_bundles(self, property_data: PropertySchema, bundle_size: int, dedup_index: ImageDedupIndex = None) -> AsyncIterator[List[Union[str, ExtractedImage]]]:
+        # yields each bundle as soon as it is filled, so it can be classified and uploaded while extraction goes on
+        bundle = []
+        async for image in self.iter_images(property_data, dedup_index):
+            bundle.append(image)
+            if len(bundle) >= bundle_size:
+                yield bundle
+                bundle = []
+
+        if bundle:
+            yield bundle
+
+    async def iter_images(self, property_data: PropertySchema, dedup_index: ImageDedupIndex = None) -> AsyncIterator[Union[str, ExtractedImage]]:
+        download_path = self.file_repository.get_local_dir(property_data)
+        # an image repeated in the OM, the flyer and the brochure is only extracted from the first PDF
+        if dedup_index is None:
+            dedup_index = ImageDedupIndex()
+
+        if len(property_data.pdfs) <= 1 or config.pdf_concurrency <= 1:
+            for pdf in property_data.pdfs:
+                async for image in self.iter_pdf_images(pdf, download_path, dedup_index):
+                    yield image
+            return
+
+        # PDFs are downloaded and extracted concurrently, images are yielded in the order they come out
+        semaphore = asyncio.Semaphore(config.pdf_concurrency)
+        queue = asyncio.Queue(maxsize=config.pdf_extraction_queue_size)
+        done = object()
+
+        async def load_pdf_images(pdf: PdfSchema):
+            async with semaphore:
+                images = self.iter_pdf_images(pdf, download_path, dedup_index)
+                try:
+                    async for image in images:
+                        await queue.put(image)
+                finally:
+                    await images.aclose()
+
+        async def load_all():
+            # the task group cancels and awaits the other PDFs when one fails, so none is left blocked on the queue;
+            # a cancelled loader puts nothing: the consumer is gone and a full queue would block it forever
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    for pdf in property_data.pdfs:
+                        task_group.create_task(load_pdf_images(pdf))
+            except ExceptionGroup as e:
+                await queue.put(e.exceptions[0])
+                return
+            await queue.put(done)
+
+        loader = asyncio.create_task(load_all())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # stops the remaining downloads and extractions if the consumer gave up early
+            loader.cancel()
+            await asyncio.gather(loader, return_exceptions=True)
+
+    async def iter_pdf_images(self, pdf: PdfSchema, download_path: str, dedup_index: ImageDedupIndex) -> AsyncIterator[Union[str, ExtractedImage]]:
+        if config.pdf_memory_download:
+            pdf_source = await self.file_repository.load_pdf(pdf, download_path)
+            if pdf_source is None:
+                return
+            try:
+                async for image in self.gallery_service.iter_images_from_pdf(
+                    pdf_source, in_memory=config.in_memory_pipeline, dedup_index=dedup_index
+                ):
+                    yield image
+            finally:
+                pdf_source.close()
+            return
+
+        pdf_file_path = await self.file_repository.download_pdf(pdf, download_path)
+        async for image in self.gallery_service.iter_images_from_pdf(
+            pdf_file_path, in_memory=config.in_memory_pipeline, dedup_index=dedup_index
+        ):
+            yield image
+
+    async def process_images(self, property_images: PropertyImagesSchema, dedup_index: ImageDedupIndex = None):
         property_data = property_images.property_data
         image_paths = property_images.images
 
-        valid_paths = await self.gallery_service.classify_images(
+        valid_paths, scores = await self.gallery_service.classify_scored_images(
             image_paths
         )
 
         image_urls = []
         for path in valid_paths:
             url = self.file_repository.get_image_url(
-                path,
+                path.path if isinstance(path, ExtractedImage) else path,
                 property_data.property_id
             )
             image_urls.append(url)
 
         # Run the upload and cleanup in a separate thread
-        await self.upload_images_and_cleanup(property_data, valid_paths)
+        uploaded_urls = await self.upload_images_and_cleanup(property_data, valid_paths)
+
+        if dedup_index is not None:
+            self.settle_images(dedup_index, image_paths, scores, valid_paths, uploaded_urls)
 
         return image_urls
 
-    async def upload_images_and_cleanup(self, property_data: PropertySchema, valid_paths: List[str]):
-        upload_tasks = [self.file_repository.upload_image(path, property_data.property_id) for path in valid_paths]
-        await asyncio.gather(*upload_tasks)
+    def settle_images(self, dedup_index: ImageDedupIndex, images: list, scores: List[Optional[float]], valid_images: list, uploaded_urls: List[Optional[str]]) -> None:
+        # only images with a final outcome are skipped by later runs: classification errors (score None) and
+        # valid images whose upload failed are left pending, so the next run processes them again
+        def get_path(image) -> str:
+            return image.path if isinstance(image, ExtractedImage) else image
+
+        valid = {get_path(image) for image in valid_images}
+        uploaded = {get_path(image) for image, url in zip(valid_images, uploaded_urls) if url}
+        for image, score in zip(images, scores):
+            path = get_path(image)
+            if score is None or (path in valid and path not in uploaded):
+                continue
+            dedup_index.settle(path)
+
+    async def upload_images_and_cleanup(self, property_data: PropertySchema, valid_paths: List[Union[str, ExtractedImage]]) -> List[Optional[str]]:
+        # in-memory images are uploaded from their buffers, only images written to disk need a cleanup;
+        # returns the uploaded URLs, None where the upload failed
+        upload_tasks = [self.upload_image(image, property_data.property_id) for image in valid_paths]
+        uploaded_urls = await asyncio.gather(*upload_tasks)
 
-        cleanup_tasks = [self.delete_file(path) for path in valid_paths]
+        cleanup_tasks = [self.delete_file(path) for path in valid_paths if isinstance(path, str)]
         await asyncio.gather(*cleanup_tasks)
+        return uploaded_urls
+
+    async def upload_image(self, image: Union[str, ExtractedImage], property_id: str) -> str:
+        if isinstance(image, ExtractedImage):
+            image_bytes = await cpu_executor.run(image.to_bytes)
+            return await self.file_repository.upload_image_bytes(
+                image_bytes, os.path.basename(image.path), property_id
+            )
+        return await self.file_repository.upload_image(image, property_id)
 
     async def delete_file(self, path: str):
         try:
@@ -5,7 +5,7 @@ import os
 import random
 import string
 import uuid
-from typing import List, Any
+from typing import Callable, List, Any
 
 
 def gen_kebab_name(block_len=4, n_blocks=3) -> str:
@@ -40,5 +40,16 @@ def prep_hash(data):
     hasher.update(data)
     return hasher.hexdigest()
 
+def get_digest_func(algorithm='sha256') -> Callable[[bytes], bytes]:
+    # raw digests for in-process dedup keys; xxh3_128 needs the optional xxhash package
+    if algorithm == 'blake2b':
+        return lambda data: hashlib.blake2b(data, digest_size=16).digest()
+    if algorithm == 'sha256':
+        return lambda data: hashlib.sha256(data).digest()
+    if algorithm == 'xxh3_128':
+        import xxhash
+        return xxhash.xxh3_128_digest
+    raise ValueError(f"Unknown digest algorithm: {algorithm}")
+
 def chunk_list(lst: List[Any], chunk_size: int) -> List[List[Any]]:
     return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
\ No newline at end of file